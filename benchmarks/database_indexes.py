@@ -0,0 +1,74 @@
+"""Lookup times of a large guild database before and after initialize_db_with_tables adds the secondary indexes.
+
+    python -m benchmarks.database_indexes [n_players] [n_events]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from raidbot.database import EVENT_COLUMNS, EVENT_COLUMNS_TYPES, INSERT_EVENT_SQL, INSERT_PLAYER_SQL, \
+    PLAYER_COLUMNS, PLAYER_COLUMNS_TYPES, SERVER_INFO_COLUMNS, SERVER_INFO_COLUMNS_TYPES, configure_connection, \
+    create_server_info, create_table, create_table_sql_command, get_events_by_state, get_player, get_player_by_id, \
+    get_player_by_name, get_server_info, initialize_db_with_tables
+
+STATES = ["COMPLETE", "CANCELLED", "UNDERSIZED", "MANUAL"]
+
+
+def fill(conn, n_players, n_events, rng):
+    """Tables as an old bot version created them, without indexes, filled with n_players and n_events rows"""
+    create_table(conn, create_table_sql_command("players", PLAYER_COLUMNS, PLAYER_COLUMNS_TYPES))
+    create_table(conn, create_table_sql_command("events", EVENT_COLUMNS, EVENT_COLUMNS_TYPES))
+    create_table(conn, create_table_sql_command("server_info", SERVER_INFO_COLUMNS, SERVER_INFO_COLUMNS_TYPES))
+    conn.executemany(INSERT_PLAYER_SQL, [(i, f"Player {i}", "PLD,WHM,DNC", "2021-05-01", 0, 0)
+                                         for i in range(n_players)])
+    # Nearly all events are over, only a few are still recruiting
+    conn.executemany(INSERT_EVENT_SQL, [(f"Raid {i}", i, None, None, None, None, "2,2,4", 1, None,
+                                         "RECRUITING" if i % 10000 == 0 else rng.choice(STATES), None, None, None)
+                                        for i in range(n_events)])
+    conn.commit()
+    for i in range(50):
+        create_server_info(conn, f"setting_{i}", str(i))
+    create_server_info(conn, "event_channel", "<#1234>")
+
+
+def time_lookups(conn, n_players, rng, repeats=200):
+    """Mean milliseconds per call of each lookup"""
+    ids = [rng.randrange(n_players) for _ in range(repeats)]
+    lookups = {
+        "get_player_by_id": lambda i: get_player_by_id(conn, i),
+        "get_player": lambda i: get_player(conn, i, f"Player {i}"),
+        "get_player_by_name": lambda i: get_player_by_name(conn, f"Player {i}"),
+        "get_server_info": lambda i: get_server_info(conn, "event_channel"),
+        "get_events_by_state": lambda i: get_events_by_state(conn, "RECRUITING"),
+    }
+    times = {}
+    for name, lookup in lookups.items():
+        start = time.perf_counter()
+        for i in ids:
+            lookup(i)
+        times[name] = (time.perf_counter() - start) / repeats * 1000
+    return times
+
+
+if __name__ == '__main__':
+    n_players = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_events = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "guild.db"))
+        configure_connection(conn)
+        fill(conn, n_players, n_events, rng)
+        before = time_lookups(conn, n_players, rng)
+        start = time.perf_counter()
+        initialize_db_with_tables(conn)
+        migration = time.perf_counter() - start
+        after = time_lookups(conn, n_players, rng)
+        conn.close()
+
+    print(f"{n_players} players, {n_events} events, indexes created at startup in {migration:.2f} s")
+    print(f"{'lookup':22s} {'before':>10s} {'after':>10s}")
+    for name in before:
+        print(f"{name:22s} {before[name]:8.3f}ms {after[name]:8.3f}ms")
@@ -0,0 +1,53 @@
+"""Writes per second of a guild database, as the bot's sign-up path does them.
+Compares a connection with SQLite's default rollback journal to one set up by create_connection (WAL and the
+CONNECTION_PRAGMAS), and the latter again with each sign-up written in one transaction.
+
+    python -m benchmarks.database_writes [n_signups]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from raidbot.database import add_participant, configure_connection, create_event, create_player, \
+    initialize_db_with_tables, transaction, update_player
+
+
+def open_db(path, configured):
+    conn = sqlite3.connect(path)
+    if configured:
+        configure_connection(conn)
+    initialize_db_with_tables(conn)
+    return conn
+
+
+def signups(conn, n_signups, batched):
+    """Signs n_signups players into an event, returning the number of writes issued and the seconds it took"""
+    ev_id = create_event(conn, ("Raid", 0, None, None, None, None, "2,2,4", 1, None, "RECRUITING", None, None, None))
+    for i in range(n_signups):
+        create_player(conn, (i, f"Player {i}", "PLD,WHM,DNC", "2021-05-01", 0, 0))
+
+    start = time.perf_counter()
+    for i in range(n_signups):
+        if batched:
+            with transaction(conn):
+                add_participant(conn, ev_id, i, f"Player {i}", 0)
+                update_player(conn, "num_raids", 1, i, f"Player {i}")
+        else:
+            add_participant(conn, ev_id, i, f"Player {i}", 0)
+            update_player(conn, "num_raids", 1, i, f"Player {i}")
+    return 2 * n_signups, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    n_signups = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, configured, batched in [("default journal, commit per write", False, False),
+                                           ("WAL + pragmas, commit per write", True, False),
+                                           ("WAL + pragmas, one transaction per sign-up", True, True)]:
+            path = os.path.join(tmp, f"{label}.db")
+            conn = open_db(path, configured)
+            writes, seconds = signups(conn, n_signups, batched)
+            conn.close()
+            print(f"{label:45s} {writes / seconds:10.0f} writes/s")
@@ -1,9 +1,15 @@
 import raidbot.bot as bot
+from raidbot.shards import ShardSupervisor
 from dotenv import load_dotenv
 import os
 
 if __name__ == '__main__':
     load_dotenv()
     TOKEN = os.getenv('DISCORD_TOKEN')
-    bot.run(TOKEN)
+    shard_count = int(os.getenv('SHARD_COUNT', 1))
+    if shard_count > 1 and bot.shard_id is None:
+        # Supervisor: runs this script once per shard, each with its own SHARD_ID
+        ShardSupervisor(shard_count).run()
+    else:
+        bot.run(TOKEN)
 
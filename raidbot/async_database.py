@@ -0,0 +1,119 @@
+"""Async access to the guild databases for the bot's event handlers.
+Each database is owned by its own worker thread, so sqlite3 I/O never blocks the event loop and the queries of one
+guild run one after another."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from raidbot import database
+
+
+def _operation(fn):
+    """Turns a function of raidbot.database into a coroutine method running on the database thread"""
+    async def operation(self, *args, **kwargs):
+        return await self.run(fn, *args, **kwargs)
+    operation.__name__ = fn.__name__
+    operation.__doc__ = fn.__doc__
+    return operation
+
+
+def _opened(conn):
+    pass
+
+
+def _in_transaction(conn, fn, *args, **kwargs):
+    with database.transaction(conn):
+        return fn(conn, *args, **kwargs)
+
+
+class AsyncDatabase:
+    """A guild database whose connection lives on a dedicated thread.
+    Offers the operations of raidbot.database as coroutines, e.g. `await db.get_event(event_id)`, and runs any
+    other function taking the connection as first argument with `await db.run(fn, *args)`."""
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-{db_file}")
+        self._conn = None
+        self._failure = None  # why the database could not be opened, it is not tried again
+
+    def _open(self):
+        if self._failure is not None:
+            raise database.Error(f"Database {self.db_file} is unusable: {self._failure}")
+        conn = database.create_connection(self.db_file)
+        if conn is None:
+            self._failure = "could not open it"
+            raise database.Error(f"Could not open database {self.db_file}")
+        try:
+            # Databases of guilds the bot joined a while ago might still lack newer tables and columns
+            database.initialize_db_with_tables(conn)
+        except Exception as e:
+            conn.close()
+            self._failure = f"initializing it failed with {e!r}"
+            raise
+        self._conn = conn
+
+    def _call(self, fn, args, kwargs):
+        # sqlite3 connections may only be used by the thread that created them, so it is opened here
+        if self._conn is None:
+            self._open()
+        return fn(self._conn, *args, **kwargs)
+
+    async def open(self):
+        """Opens and initializes the database if that did not happen yet. Raises if the database can't be used, after
+        the first failure without trying again."""
+        await self.run(_opened)
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn(conn, *args, **kwargs) on the database thread and returns its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args, kwargs)
+
+    async def run_in_transaction(self, fn, *args, **kwargs):
+        """Like run, but everything fn changes is committed at once, or not at all if it raises"""
+        return await self.run(_in_transaction, fn, *args, **kwargs)
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        """Closes the connection once all queued queries are done, without waiting for them"""
+        self._executor.submit(self._close_connection)
+        self._executor.shutdown(wait=False)
+
+    initialize_db_with_tables = _operation(database.initialize_db_with_tables)
+
+    create_player = _operation(database.create_player)
+    get_player = _operation(database.get_player)
+    get_player_by_id = _operation(database.get_player_by_id)
+    get_player_by_name = _operation(database.get_player_by_name)
+    get_players_by_ids = _operation(database.get_players_by_ids)
+    update_player = _operation(database.update_player)
+    update_player_fields = _operation(database.update_player_fields)
+    increment_player_counter = _operation(database.increment_player_counter)
+    update_jobs = _operation(database.update_jobs)
+    delete_player = _operation(database.delete_player)
+    delete_all_players = _operation(database.delete_all_players)
+
+    create_event = _operation(database.create_event)
+    find_events = _operation(database.find_events)
+    get_event_by_message = _operation(database.get_event_by_message)
+    get_event_message_ids = _operation(database.get_event_message_ids)
+    set_event_message = _operation(database.set_event_message)
+    get_event_participants = _operation(database.get_event_participants)
+    get_events_of_player = _operation(database.get_events_of_player)
+    add_participant = _operation(database.add_participant)
+    remove_participant = _operation(database.remove_participant)
+    set_participant_bench = _operation(database.set_participant_bench)
+    set_event_roster = _operation(database.set_event_roster)
+    get_event = _operation(database.get_event)
+    get_events_by_state = _operation(database.get_events_by_state)
+    get_last_x_events = _operation(database.get_last_x_events)
+    update_event = _operation(database.update_event)
+    update_event_fields = _operation(database.update_event_fields)
+    delete_event = _operation(database.delete_event)
+    delete_all_events = _operation(database.delete_all_events)
+
+    get_server_info = _operation(database.get_server_info)
+    create_server_info = _operation(database.create_server_info)
+    update_server_info = _operation(database.update_server_info)
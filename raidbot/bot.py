@@ -4,23 +4,46 @@ import os
 import random
 import traceback
 import asyncio
+import functools
+import time
 
 import discord
 from discord.ext import commands
 from pytz import timezone
 
-from raidbot.event import make_event_from_db, Event
+from raidbot.event import make_event_from_db, make_events_in_state, Event
+from raidbot.event_cache import EventCache
+from raidbot.character_cache import CharacterCache
+from raidbot.event_locks import LockRegistry
 from raidbot.database import *
-from raidbot.raidbuilder import make_character_from_db, Character, make_raid, JOBS
+from raidbot.async_database import AsyncDatabase
+from raidbot.raidbuilder import make_characters_from_db, Character, make_raid, JOB_IDS, SearchToken, SearchCancelled
 from raidbot.emoji_dict import emoji_dict
+from raidbot.render_queue import RenderQueue
+from raidbot.shards import shard_of, shard_settings, write_status
 
 intents = discord.Intents().default()
 intents.members = True
-bot = commands.Bot(command_prefix='$', intents=intents)
+# Set by ShardSupervisor when this process is one of several shards, see raidbot.shards
+shard_id, shard_count = shard_settings()
+if shard_count is None:
+    bot = commands.Bot(command_prefix='$', intents=intents)
+else:
+    bot = commands.Bot(command_prefix='$', intents=intents, shard_id=shard_id, shard_count=shard_count)
+shard_load = {"reactions": 0, "commands": 0}  # handled since start, reported to the supervisor
+connections = ConnectionPool(AsyncDatabase)
+event_message_ids = {}  # guild id -> ids of all messages that are event posts, see is_event_message
+render_queue = RenderQueue(delay=1.5)  # at most one roster update of an event post per 1.5 seconds
+event_cache = EventCache()
+character_cache = CharacterCache(max_size=4096)
+event_locks = LockRegistry()  # (guild id, event id) -> lock held while the event's roster or state changes
+startup_task = None  # see start_up, runs once after the first on_ready
 
 
 def run(TOKEN):
     bot.run(TOKEN)
+    connections.close_all()
+    print(f"Character cache: {character_cache.hits} hits, {character_cache.misses} misses")
 
 
 def job_emoji_str(job_list):
@@ -42,6 +65,15 @@ def ping_string(list_of_ids):
     return ping_str[:-2]
 
 
+def int_setting(name, default):
+    """Positive integer setting from the environment (or .env file), e.g. RAID_BUILDER_WORKERS"""
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        print(f"{name} is not a number, using {default}")
+        return default
+
+
 def build_countdown_link(timestamp):
     dt_obj = datetime.fromtimestamp(timestamp, tz=timezone("UTC"))
     link = f"https://www.timeanddate.com/countdown/generic?iso={dt_obj.year}{dt_obj.month:02}{dt_obj.day:02}" \
@@ -51,14 +83,115 @@ def build_countdown_link(timestamp):
 
 @bot.event
 async def on_ready():
+    global startup_task
     print(f'{bot.user.name} has connected to Discord!')
+    if startup_task is None:
+        startup_task = asyncio.ensure_future(start_up(int_setting("DB_STARTUP_WORKERS", 16)))
+    elif startup_task.done():
+        # on_ready is sent again after reconnects, only guilds joined in the meantime are missing
+        await asyncio.gather(*[prepare_guild(guild.id) for guild in bot.guilds if guild.id not in event_cache.warmed])
+
+
+async def start_up(max_parallel):
+    """Gets every guild ready before it is used: finds the guild databases, initializes and migrates them, and loads
+    the recruiting events into the event cache, at most max_parallel guilds at once and each on its database thread,
+    so the gateway connection keeps running. Handlers that come first open and initialize what they need themselves.
+    """
+    if shard_count is not None:
+        asyncio.ensure_future(report_shard_status())
+    start = time.perf_counter()
+    # Databases of guilds that belong to other shards are left to them
+    on_disk = {guild_id for guild_id in list_guild_databases() if owns_guild(guild_id)}
+    joined = {guild.id for guild in bot.guilds}
+    guild_ids = sorted(on_disk | joined)
+    discovered = time.perf_counter()
+    # One pass per guild on a single handle, so the pool can't close the connection between initializing and warming
+    timings = {"initialize": 0.0, "warm": 0.0}
+    ready = await for_each_guild(lambda guild_id: prepare_guild(guild_id, guild_id in joined, timings), guild_ids,
+                                 max_parallel)
+    prepared = time.perf_counter()
+    print(f"Startup: found {len(on_disk)} guild databases and {len(joined - on_disk)} joined guilds without one in "
+          f"{discovered - start:.2f} s, initialized {sum(ready)} (schema version {SCHEMA_VERSION}, "
+          f"{timings['initialize']:.2f} s summed over guilds), loaded {len(event_cache)} recruiting events "
+          f"({timings['warm']:.2f} s summed over guilds), {prepared - discovered:.2f} s for both with up to "
+          f"{max_parallel} guilds at once")
+
+
+def owns_guild(guild_id):
+    return shard_count is None or shard_of(guild_id, shard_count) == shard_id
+
+
+async def report_shard_status(interval=30.0):
+    while not bot.is_closed():
+        try:
+            write_status(shard_id, {"guilds": len(bot.guilds), "latency": bot.latency, **shard_load})
+        except OSError as e:
+            print(f"Could not write the status of shard {shard_id}: {e}")
+        await asyncio.sleep(interval)
+
+
+async def for_each_guild(fn, guild_ids, max_parallel):
+    """Runs the coroutine function fn(guild_id) for every guild, at most max_parallel at once"""
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def bounded(guild_id):
+        async with semaphore:
+            return await fn(guild_id)
+    return await asyncio.gather(*[bounded(guild_id) for guild_id in guild_ids])
+
+
+async def prepare_guild(guild_id, warm=True, timings=None):
+    """Opens a guild's database, which creates its tables or migrates them to the current schema, and with warm
+    loads its recruiting events into the event cache. True if the database could be opened.
+    The seconds both steps took are added to timings["initialize"] and timings["warm"] if given."""
+    begin = time.perf_counter()
+    conn = await get_connection(guild_id)
+    opened = time.perf_counter()
+    if timings is not None:
+        timings["initialize"] += opened - begin
+    if conn is None:
+        return False
+    try:
+        if warm:
+            event_cache.warm(guild_id, await conn.run(make_events_in_state, "RECRUITING"))
+    except Exception as e:
+        print(f"Could not load the events of guild {guild_id}: {e}")
+    finally:
+        conn.close()
+        if timings is not None:
+            timings["warm"] += time.perf_counter() - opened
+    return True
+
+
+async def get_connection(guild_id):
+    """Handle to the guild's database, opened and initialized on its thread, or None if the database can't be used"""
+    conn = connections.get(guild_id)
+    if conn is None:
+        return None
+    try:
+        await conn.open()
+    except Exception as e:
+        print(f"Could not open the database of guild {guild_id}: {e}")
+        conn.close()
+        return None
+    return conn
+
+
+async def load_event(conn, guild_id, ev_id):
+    """The event with the given id, from the cache if it is still recruiting"""
+    event = event_cache.get(guild_id, ev_id)
+    if event is None:
+        event = await conn.run(make_event_from_db, ev_id)
+        # Another handler might have cached it while this one was loading, there must only be one Event object
+        event = event_cache.get(guild_id, event.id) or event
+        event_cache.put(guild_id, event)
+    return event
 
 
 @bot.event
 async def on_guild_join(guild):
-    conn = create_connection(guild.id)
-    initialize_db_with_tables(conn)
-    conn.close()
+    # Runs on the guild's database thread, the event loop only waits for it
+    await prepare_guild(guild.id)
 
 
 @bot.command(name='hello', help='Answers with an appropriate hello message')
@@ -105,13 +238,13 @@ async def set_event_channel(ctx, channel):
         await ctx.send(f'The bot does not have the required permissions in channel {channel}. '
                        f'Please set the correct permissions beforehand.')
         return
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
-        db_channel = get_server_info(conn, "event_channel")
+        db_channel = await conn.get_server_info("event_channel")
         if db_channel:
-            update_server_info(conn, "event_channel", channel)
+            await conn.update_server_info("event_channel", channel)
         else:
-            create_server_info(conn, "event_channel", channel)
+            await conn.create_server_info("event_channel", channel)
         conn.close()
         await ctx.send(f"Channel {channel} is set as event_channel. All events will now be posted there.")
     else:
@@ -162,10 +295,10 @@ def make_character_embed(ch: Character, date, num_raids):
 
 @bot.command(name='show-event', help='Shows an event from the database given its id')
 async def show_event(ctx, event_id):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         try:
-            event = make_event_from_db(conn, event_id)
+            event = await load_event(conn, ctx.guild.id, event_id)
             embed = make_event_embed(event, ctx.guild)
             if event.message_link:
                 embed.add_field(name="**Original post**", value=f"[link]({event.message_link})", inline=False)
@@ -181,10 +314,10 @@ async def show_event(ctx, event_id):
 @bot.command(name='show-character', help='Shows characters registered with the given Discord ID')
 async def show_character(ctx, discord_id):
     num_id = int(discord_id[3:-1])
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         try:  # TODO: handle multiple characters registered with the same discord id
-            chara, date, num_raids = make_character_from_db(conn, num_id, None)
+            chara, date, num_raids = await character_cache.get(conn, ctx.guild.id, num_id)
             embed = make_character_embed(chara, date, num_raids)
             conn.close()
             await ctx.send(f"<@{num_id}>'s character:", embed=embed)
@@ -202,7 +335,7 @@ async def show_character(ctx, discord_id):
                                      'for eaxmple <name>, you need to put name in quotation marks like this:'
                                      ' "Event Name"')
 async def make_event(ctx, name, date, start_time, num_tanks, num_heals, num_dps, user_timezone="UTC"):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         try:
             tz = timezone(user_timezone)
@@ -227,18 +360,18 @@ async def make_event(ctx, name, date, start_time, num_tanks, num_heals, num_dps,
 
         event_tup = (name, int(dt_obj.timestamp()), None, None, None,
                      None, f"{num_tanks},{num_heals},{num_dps}",
-                     int(ctx.message.author.id), None, "RECRUITING")
-        ev_id = create_event(conn, event_tup)
+                     int(ctx.message.author.id), None, "RECRUITING", None, None, None)
+        ev_id = await conn.create_event(event_tup)
 
         try:
-            event = make_event_from_db(conn, ev_id)
+            event = await conn.run(make_event_from_db, ev_id)
         except Exception:
             conn.close()
             await ctx.send(f'Could not find event with id {ev_id}. This event might not exist (yet).')
             return
         embed = make_event_embed(event, ctx.guild, True)
         # Check if we have an event channel
-        db_eventchannel = get_server_info(conn, "event_channel")
+        db_eventchannel = await conn.get_server_info("event_channel")
         if db_eventchannel:
             channel = db_eventchannel[0][2]
             message = await ctx.guild.get_channel(int(channel[2:-1])).send(embed=embed)
@@ -247,7 +380,12 @@ async def make_event(ctx, name, date, start_time, num_tanks, num_heals, num_dps,
             await ctx.send(embed=new_embed)
         else:
             message = await ctx.send(embed=embed)
-        update_event(conn, "message_link", message.jump_url, ev_id)
+        await conn.set_event_message(ev_id, message.jump_url)
+        event.message_link = message.jump_url
+        event.guild_id, event.channel_id, event.message_id = message_ids_from_link(message.jump_url)
+        event_cache.put(ctx.guild.id, event)
+        if ctx.guild.id in event_message_ids:  # otherwise it is loaded with the others on the next reaction
+            event_message_ids[ctx.guild.id].add(message.id)
         await message.add_reaction(emoji_dict["sign_in"])
         await message.add_reaction(emoji_dict["bench"])
         await message.add_reaction(emoji_dict["sign_out"])
@@ -262,21 +400,22 @@ async def make_event(ctx, name, date, start_time, num_tanks, num_heals, num_dps,
                                      'Field can be either name, date, or time. The user_timezone parameter will only '
                                      'matter if the field is "time" and is otherwise ignored.')
 async def edit_event(ctx, ev_id, field, value, user_timezone="UTC"):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
-        db_ev = get_event(conn, ev_id)
+        db_ev = await conn.get_event(ev_id)
         if db_ev:
-            event = make_event_from_db(conn, ev_id)
+            event = await load_event(conn, ctx.guild.id, ev_id)
             if event.creator_id != ctx.message.author.id:
                 conn.close()
                 await ctx.send(f'You are not the author for this event. Only the author can edit events.')
                 return
             if field == "name":
-                update_event(conn, "name", value, event.id)
+                await conn.update_event("name", value, event.id)
                 link = event.message_link.split('/')
                 message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                     int(link[-1]))
                 event.name = value
+                render_queue.discard((message.guild.id, event.id))
                 embed = make_event_embed(event, message.guild, True if event.state == "RECRUITING" else False)
                 await message.edit(embed=embed)
                 await ctx.send("Event name updated.")
@@ -294,11 +433,12 @@ async def edit_event(ctx, ev_id, field, value, user_timezone="UTC"):
                                    f"dd-mm-yyyy")
                     return
                 timestamp = int(dt_object.timestamp())
-                update_event(conn, "timestamp", timestamp, event.id)
+                await conn.update_event("timestamp", timestamp, event.id)
                 link = event.message_link.split('/')
                 message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                     int(link[-1]))
                 event.timestamp = timestamp
+                render_queue.discard((message.guild.id, event.id))
                 embed = make_event_embed(event, message.guild, True if event.state == "RECRUITING" else False)
                 await message.edit(embed=embed)
                 await ctx.send("Event date updated.")
@@ -328,11 +468,12 @@ async def edit_event(ctx, ev_id, field, value, user_timezone="UTC"):
                                    f"hh:mm (in 24 hour format)")
                     return
                 timestamp = int(dt_object.timestamp())
-                update_event(conn, "timestamp", timestamp, event.id)
+                await conn.update_event("timestamp", timestamp, event.id)
                 link = event.message_link.split('/')
                 message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                     int(link[-1]))
                 event.timestamp = timestamp
+                render_queue.discard((message.guild.id, event.id))
                 embed = make_event_embed(event, message.guild, True if event.state == "RECRUITING" else False)
                 await message.edit(embed=embed)
                 await ctx.send("Event time updated.")
@@ -353,6 +494,30 @@ async def edit_event(ctx, ev_id, field, value, user_timezone="UTC"):
         return
 
 
+async def follow_raid_search(author, progress_msg, event, search, token, interval=2.0):
+    """Waits for a running make_raid call, showing its progress in progress_msg.
+    The search is cancelled if the author answers with `esc` in the meantime."""
+    def check(m):
+        return author == m.author and not m.guild and m.content == "esc"
+
+    esc = asyncio.ensure_future(bot.wait_for('message', check=check))
+    shown = None
+    try:
+        while not search.done():
+            await asyncio.wait({search, esc}, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+            if esc.done():
+                token.cancel()
+                break
+            percent = int(token.progress * 100)
+            if percent != shown and not search.done():
+                shown = percent
+                await progress_msg.edit(content=f'Building a group for event {event.id} ... {percent}%\n'
+                                                f'`esc` - stop building')
+    finally:
+        esc.cancel()
+    return await search
+
+
 @bot.command(name='close-event', help='closes recruitment for an event. Will ask you to decide on the composition'
                                       'via DM. Needs the event ID.\nOptional: Turn off settings the bot uses to help'
                                       'narrow down the search for a *good* raid composition.\nSettings are:\n'
@@ -364,13 +529,14 @@ async def edit_event(ctx, ev_id, field, value, user_timezone="UTC"):
                                       'provided compositions. They will still be displayed '
                                       'if they are the only option.\n')
 async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter=True, no_double_jobs=True):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
-        db_ev = get_event(conn, ev_id)
+        db_ev = await conn.get_event(ev_id)
         if db_ev:
-            event = make_event_from_db(conn, ev_id)
+            # Not the cached event: sign-ups during the dialogue below must not change the roster being closed
+            event = await conn.run(make_event_from_db, ev_id)
             # Check if we have an event channel
-            db_eventchannel = get_server_info(conn, "event_channel")
+            db_eventchannel = await conn.get_server_info("event_channel")
             if db_eventchannel:
                 channel_tag = db_eventchannel[0][2]
                 channel = ctx.guild.get_channel(int(channel_tag[2:-1]))
@@ -410,7 +576,10 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
                         message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                             int(link[-1]))
                         event.state = "CANCELLED"
-                        update_event(conn, "state", event.state, event.id)
+                        async with event_locks.hold((ctx.guild.id, event.id)):
+                            await conn.update_event("state", event.state, event.id)
+                            event_cache.evict(ctx.guild.id, event.id)
+                        render_queue.discard((message.guild.id, event.id))
                         embed = make_event_embed(event, message.guild, False)
                         await message.edit(embed=embed)
                         for em in [emoji_dict["sign_in"], emoji_dict["sign_out"], emoji_dict["bench"]]:
@@ -425,12 +594,19 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
                         message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                             int(link[-1]))
                         event.state = "UNDERSIZED"
-                        update_event(conn, "state", event.state, event.id)
                         # all benched will need to participate
                         for i, _ in enumerate(event.is_bench):
                             event.is_bench[i] = 0
-                        update_event(conn, "is_bench", col_str(event.is_bench), event.id)
+
+                        def store_undersized_event(db_conn):
+                            update_event(db_conn, "state", event.state, event.id)
+                            set_event_roster(db_conn, event.id, event.participant_ids, event.participant_names,
+                                             event.is_bench)
+                        async with event_locks.hold((ctx.guild.id, event.id)):
+                            await conn.run_in_transaction(store_undersized_event)
+                            event_cache.evict(ctx.guild.id, event.id)
                         # Jobs need to be figured out on their own, pf can fill anything right?
+                        render_queue.discard((message.guild.id, event.id))
                         embed = make_event_embed(event, message.guild, False)
                         await message.edit(embed=embed)
                         for em in [emoji_dict["sign_in"], emoji_dict["sign_out"], emoji_dict["bench"]]:
@@ -454,20 +630,35 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
                 # THIS IS WHERE THE MAGIC HAPPENS!
                 # Get Information from event
                 participants = []
-                num_raids = []
-                for i, p_id in enumerate(event.participant_ids):
-                    chara, _, n_raid = make_character_from_db(conn, p_id, event.participant_names[i])
+                loaded = await conn.run(make_characters_from_db, event.participant_ids, event.participant_names)
+                for i, (chara, _, _) in enumerate(loaded):
                     if event.is_bench[i]:
                         chara.benched = True
                     participants.append(chara)
-                    num_raids.append(n_raid)
-
-                await ctx.message.author.send(f'Building a group for event {event.id} ...')
-                # Get X best raids
-                best_raids = make_raid(participants, event.role_numbers[0], event.role_numbers[1], event.role_numbers[2],
-                                       no_double_jobs=no_double_jobs,
-                                       maximize_diverse_dps=maximize_diverse_dps,
-                                       use_benched_counter=use_benched_counter)
+
+                progress_msg = await ctx.message.author.send(f'Building a group for event {event.id} ...\n'
+                                                             f'`esc` - stop building')
+                # Get X best raids, off the event loop so the bot keeps running meanwhile
+                token = SearchToken(time_budget=int_setting('RAID_BUILDER_TIME_BUDGET', 600))
+                search = bot.loop.run_in_executor(None, functools.partial(
+                    make_raid, participants, event.role_numbers[0], event.role_numbers[1], event.role_numbers[2],
+                    no_double_jobs=no_double_jobs,
+                    maximize_diverse_dps=maximize_diverse_dps,
+                    use_benched_counter=use_benched_counter,
+                    workers=int_setting('RAID_BUILDER_WORKERS', 1),
+                    token=token))
+                try:
+                    best_raids = await follow_raid_search(ctx.message.author, progress_msg, event, search, token)
+                except SearchCancelled:
+                    conn.close()
+                    if token.timed_out:
+                        await ctx.message.author.send(f'Building a group took too long, '
+                                                      f'stopping $close-event dialogue.')
+                    else:
+                        await ctx.message.author.send(f'Stopping $close-event dialogue.')
+                    return
+                print(f"Raid search for event {event.id} in guild {ctx.guild.id}: pruned {token.pruned_groups} "
+                      f"groups or branches and {token.pruned_products} job products")
                 if not best_raids:
                     # No viable combination was found
                     await ctx.message.author.send(f"I could not create a viable group given the participants' jobs and "
@@ -497,7 +688,10 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
                             message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                                 int(link[-1]))
                             event.state = "CANCELLED"
-                            update_event(conn, "state", event.state, event.id)
+                            async with event_locks.hold((ctx.guild.id, event.id)):
+                                await conn.update_event("state", event.state, event.id)
+                                event_cache.evict(ctx.guild.id, event.id)
+                            render_queue.discard((message.guild.id, event.id))
                             embed = make_event_embed(event, message.guild, False)
                             await message.edit(embed=embed)
                             for em in [emoji_dict["sign_in"], emoji_dict["sign_out"], emoji_dict["bench"]]:
@@ -512,8 +706,11 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
                             message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                                 int(link[-1]))
                             event.state = "MANUAL"
-                            update_event(conn, "state", event.state, event.id)
+                            async with event_locks.hold((ctx.guild.id, event.id)):
+                                await conn.update_event("state", event.state, event.id)
+                                event_cache.evict(ctx.guild.id, event.id)
                             # Jobs need to be figured out on their own, pf can fill anything right?
+                            render_queue.discard((message.guild.id, event.id))
                             embed = make_event_embed(event, message.guild, False)
                             await message.edit(embed=embed)
                             for em in [emoji_dict["sign_in"], emoji_dict["sign_out"], emoji_dict["bench"]]:
@@ -604,41 +801,50 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
 
                     group, comp, score = best_raids[raidnum]
                     # Update bench and jobs
+                    played = []  # (discord_id, character_name)
+                    involuntarily_benched = []
                     for i, player in enumerate(participants):
                         if player in group:
                             event.is_bench[i] = 0
                             job = comp[group.index(player)]
                             event.jobs.append(job)
                             # Players num_raids ++
-                            update_player(conn, "num_raids", num_raids[i] + 1,
-                                          player.discord_id, player.character_name)
+                            played.append((player.discord_id, player.character_name))
                         else:
                             if event.is_bench[i] == 0:
                                 # Player did not want to be benched, involuntary benches ++
-                                update_player(conn, "involuntary_benches", player.involuntary_benches + 1,
-                                              player.discord_id, player.character_name)
+                                involuntarily_benched.append((player.discord_id, player.character_name))
 
                             event.is_bench[i] = 1
                             event.jobs.append(None)
                     # Sort lists according to FF sorting
-                    job_inds = [JOBS.index(j) if j else float('Inf') for j in event.jobs]
+                    job_inds = [JOB_IDS[j] if j else float('Inf') for j in event.jobs]
                     new_inds = [j[0] for j in sorted(enumerate(job_inds), key=lambda x:x[1])]
 
                     event.participant_ids = [event.participant_ids[j] for j in new_inds]
-                    update_event(conn, "participant_ids", col_str(event.participant_ids), event.id)
                     event.participant_names = [event.participant_names[j] for j in new_inds]
-                    update_event(conn, "participant_names", col_str(event.participant_names), event.id)
                     event.jobs = [event.jobs[j] for j in new_inds]
-                    update_event(conn, "jobs", col_str(event.jobs), event.id)
                     event.is_bench = [event.is_bench[j] for j in new_inds]
-                    update_event(conn, "is_bench", col_str(event.is_bench), event.id)
+                    event.state = "COMPLETE"
+
+                    def store_closed_event(db_conn):
+                        increment_player_counter(db_conn, "num_raids", played)
+                        increment_player_counter(db_conn, "involuntary_benches", involuntarily_benched)
+                        set_event_roster(db_conn, event.id, event.participant_ids, event.participant_names,
+                                         event.is_bench, event.jobs)
+                        update_event(db_conn, "state", event.state, event.id)
+                    # Counters, roster and state are saved together, so a crash can't leave the event half-closed
+                    async with event_locks.hold((ctx.guild.id, event.id)):
+                        await conn.run_in_transaction(store_closed_event)
+                        event_cache.evict(ctx.guild.id, event.id)
+                    for discord_id, _ in played + involuntarily_benched:
+                        character_cache.invalidate(ctx.guild.id, discord_id)
 
                     # Edit Event post and make message
                     link = event.message_link.split('/')
                     message = await bot.get_guild(int(link[-3])).get_channel(int(link[-2])).fetch_message(
                         int(link[-1]))
-                    event.state = "COMPLETE"
-                    update_event(conn, "state", event.state, event.id)
+                    render_queue.discard((message.guild.id, event.id))
                     embed = make_event_embed(event, message.guild, False)
                     await message.edit(embed=embed)
                     for em in [emoji_dict["sign_in"], emoji_dict["sign_out"], emoji_dict["bench"]]:
@@ -676,13 +882,13 @@ async def close_event(ctx, ev_id, maximize_diverse_dps=True, use_benched_counter
                                              ' "Firstname Lastname"\n'
                                              "Example:\n$register-character \"Y'shtola Rhul\" \"THM,CNJ\"")
 async def register_character(ctx, name, job_list: str):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     job_list = job_list.upper()
     if conn is not None:
         disc_id = ctx.message.author.id
-        db_chara = get_player_by_id(conn, disc_id)
+        db_chara = await conn.get_player_by_id(disc_id)
         if db_chara:
-            chara, date, num_raids = make_character_from_db(conn, disc_id, None)
+            chara, date, num_raids = await character_cache.get(conn, ctx.guild.id, disc_id)
             embed = make_character_embed(chara, date, num_raids)
             conn.close()
             await ctx.send(f"There is already a character registered by <@{disc_id}>, "
@@ -691,7 +897,8 @@ async def register_character(ctx, name, job_list: str):
         try:
             chara = Character(disc_id, name, job_list, 0)
             player = (chara.discord_id, name, job_list, datetime.today().strftime('%Y-%m-%d'), 0, 0)
-            create_player(conn, player)
+            await conn.create_player(player)
+            character_cache.invalidate(ctx.guild.id, disc_id)
             embed = make_character_embed(chara, player[3], player[4])
             await ctx.send(f"<@{chara.discord_id}>'s character:", embed=embed)
         except Exception as e:
@@ -711,13 +918,14 @@ async def register_character(ctx, name, job_list: str):
 
 @bot.command(name='delete-character', help='Deletes the character registered with your discord id.')
 async def delete_character(ctx):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         disc_id = ctx.message.author.id
-        db_chara = get_player_by_id(conn, disc_id)
+        db_chara = await conn.get_player_by_id(disc_id)
         if db_chara:
-            chara, _, _ = make_character_from_db(conn, disc_id, None)
-            delete_player(conn, disc_id, chara.character_name)
+            chara, _, _ = await character_cache.get(conn, ctx.guild.id, disc_id)
+            await conn.delete_player(disc_id, chara.character_name)
+            character_cache.invalidate(ctx.guild.id, disc_id)
             conn.close()
             await ctx.send(f'Character **{chara.character_name}** by <@{disc_id}> is now deleted.')
             return
@@ -733,12 +941,12 @@ async def delete_character(ctx):
 @bot.command(name='add-job', help="adds given job at given position in your character's job list. "
                                   "Pos 0 is in front of 1st job, pos 1 in front of 2nd job etc.")
 async def add_job(ctx, job, pos):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         disc_id = ctx.message.author.id
-        db_chara = get_player_by_id(conn, disc_id)
+        db_chara = await conn.get_player_by_id(disc_id)
         if db_chara:
-            chara, date, num_raids = make_character_from_db(conn, disc_id, None)
+            chara, date, num_raids = await character_cache.get(conn, ctx.guild.id, disc_id)
             job_list = chara.jobs
             try:
                 job_list.insert(int(pos), job.upper())
@@ -753,7 +961,8 @@ async def add_job(ctx, job, pos):
                 conn.close()
                 await ctx.send(f'Could not add job. {e.msg}.')
                 return
-            update_player(conn, "jobs", col_str(chara.jobs), disc_id, chara.character_name)
+            await conn.update_player("jobs", col_str(chara.jobs), disc_id, chara.character_name)
+            character_cache.invalidate(ctx.guild.id, disc_id)
             embed = make_character_embed(chara, date, num_raids)
             conn.close()
             await ctx.send(f"<@{chara.discord_id}>'s character:", embed=embed)
@@ -769,20 +978,20 @@ async def add_job(ctx, job, pos):
 
 @bot.command(name='remove-job', help="removes the given job from your character's job list.")
 async def remove_job(ctx, job):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         disc_id = ctx.message.author.id
-        db_chara = get_player_by_id(conn, disc_id)
+        db_chara = await conn.get_player_by_id(disc_id)
         if db_chara:
-            chara, date, num_raids = make_character_from_db(conn, disc_id, None)
-            try:
-                chara.jobs.remove(job.upper())
-            except ValueError:
+            chara, date, num_raids = await character_cache.get(conn, ctx.guild.id, disc_id)
+            if job.upper() not in chara.jobs:
                 conn.close()
                 await ctx.send(f'Job {job.upper()} is not in your job list.')
                 return
+            chara.set_jobs([j for j in chara.jobs if j != job.upper()])
 
-            update_player(conn, "jobs", col_str(chara.jobs), disc_id, chara.character_name)
+            await conn.update_player("jobs", col_str(chara.jobs), disc_id, chara.character_name)
+            character_cache.invalidate(ctx.guild.id, disc_id)
             embed = make_character_embed(chara, date, num_raids)
             conn.close()
             await ctx.send(f"<@{chara.discord_id}>'s character:", embed=embed)
@@ -799,13 +1008,14 @@ async def remove_job(ctx, job):
 @bot.command(name='change-character-name', help="change the name attached to the character"
                                                 " registered with your discord id.")
 async def change_name(ctx, name):
-    conn = create_connection(ctx.guild.id)
+    conn = await get_connection(ctx.guild.id)
     if conn is not None:
         disc_id = ctx.message.author.id
-        db_chara = get_player_by_id(conn, disc_id)
+        db_chara = await conn.get_player_by_id(disc_id)
         if db_chara:
-            chara, date, num_raids = make_character_from_db(conn, disc_id, None)
-            update_player(conn, "character_name", name, disc_id, chara.character_name)
+            chara, date, num_raids = await character_cache.get(conn, ctx.guild.id, disc_id)
+            await conn.update_player("character_name", name, disc_id, chara.character_name)
+            character_cache.invalidate(ctx.guild.id, disc_id)
             chara.character_name = name
             embed = make_character_embed(chara, date, num_raids)
             conn.close()
@@ -820,101 +1030,121 @@ async def change_name(ctx, name):
         return
 
 
+def schedule_event_render(event, message):
+    """Shows the event's roster on its post once the current render window of the post is over.
+    Other edits of the post have to discard the pending render first, or it would overwrite them."""
+    async def render():
+        await message.edit(embed=make_event_embed(event, message.guild, True))
+    render_queue.schedule((message.guild.id, event.id), render)
+
+
+async def is_event_message(conn, guild_id, message_id):
+    """Whether the message is an event post, without asking discord or the database once the guild is known"""
+    if guild_id not in event_message_ids:
+        event_message_ids[guild_id] = set(await conn.get_event_message_ids())
+    return message_id in event_message_ids[guild_id]
+
+
+async def change_roster(conn, guild_id, event_id, user_id, action):
+    """
+    Applies a "sign_in", "bench" or "sign_out" reaction of a user to the roster of an event, in the database and then
+    in the event cache, so a failed write leaves both as they were. Holds the event's lock meanwhile, so reactions
+    to the same event can't overwrite each other.
+    :return: (status, event), status being "changed", "unchanged", "closed" if the event is not recruiting or
+    "unregistered" if the user has no character to sign in with
+    """
+    async with event_locks.hold((guild_id, event_id)):
+        # Looked up again under the lock, the event might have been closed while waiting for it
+        event = await load_event(conn, guild_id, event_id)
+        if event.state != "RECRUITING":
+            return "closed", event
+
+        if user_id in event.participant_ids:
+            idx = event.participant_ids.index(user_id)
+            if action == "sign_out":
+                await conn.remove_participant(event.id, user_id)
+                del event.participant_ids[idx]
+                del event.is_bench[idx]
+                del event.participant_names[idx]
+                return "changed", event
+            elif action == "bench":
+                if event.is_bench[idx] == 0:
+                    # person is not benched and wants to be benched
+                    # if it is already 1, person is already benched, nothing happens
+                    await conn.set_participant_bench(event.id, user_id, 1)
+                    event.is_bench[idx] = 1
+                    return "changed", event
+            elif action == "sign_in":
+                if event.is_bench[idx] == 1:
+                    # person is benched and wants to be signed up normally
+                    # if it is already 0, person is already signed up, nothing happens
+                    await conn.set_participant_bench(event.id, user_id, 0)
+                    event.is_bench[idx] = 0
+                    return "changed", event
+        else:
+            # user not in list yet
+            if not action == "sign_out":  # if they aren't signed in, "sign_out" will not do anything
+                try:
+                    chara, _, _ = await character_cache.get(conn, guild_id, user_id)
+                except IndexError:
+                    # user also not in db
+                    return "unregistered", event
+                if action == "sign_in":
+                    bench = 0
+                else:
+                    bench = 1
+                await conn.add_participant(event.id, chara.discord_id, chara.character_name, bench)
+                event.participant_names.append(chara.character_name)
+                event.participant_ids.append(chara.discord_id)
+                event.is_bench.append(bench)
+                return "changed", event
+        return "unchanged", event
+
+
 @bot.event
 async def on_raw_reaction_add(reaction):
+    shard_load["reactions"] += 1
     emoji = reaction.emoji
     user = reaction.member
     if user.bot:
         return
-    if emoji.name in [emoji_dict['sign_in'].split(":")[1],
-                      emoji_dict['bench'].split(":")[1],
-                      emoji_dict['sign_out'].split(":")[1]]:
-        message = await bot.get_guild(reaction.guild_id).get_channel(reaction.channel_id).fetch_message(reaction.message_id)
-        # Find corresponding event
-        conn = create_connection(reaction.guild_id)
+    actions = {emoji_dict[action].split(":")[1]: action for action in ["sign_in", "bench", "sign_out"]}
+    if emoji.name in actions:
+        # Only a handle to the message, nothing is fetched from discord for it
+        message = bot.get_guild(reaction.guild_id).get_channel(reaction.channel_id).get_partial_message(
+            reaction.message_id)
+        # Find corresponding event, without touching the database for reactions on other messages
+        event = event_cache.get_by_message(reaction.guild_id, reaction.message_id)
+        known_posts = event_message_ids.get(reaction.guild_id)
+        if event is None and known_posts is not None and reaction.message_id not in known_posts:
+            # Reaction was not on an event post
+            return
+        conn = await get_connection(reaction.guild_id)
         if conn is not None:
-            db_ev = find_events(conn, "message_link", message.jump_url)
-            if not db_ev:
-                # Reaction was not on an event post
-                conn.close()
-                return
-            event = Event(*db_ev[0])
-            if event.state != "RECRUITING":
-                await user.send(f'You are trying to sign in/out for Event {event.id}, '
-                                f'but the recruitment has ended.')
-                conn.close()
-                await message.remove_reaction(emoji, user)
-                return
-
-            if user.id in event.participant_ids:
-                idx = event.participant_ids.index(user.id)
-                if emoji.name == emoji_dict['sign_out'].split(":")[1]:
-                    del event.participant_ids[idx]
-                    del event.is_bench[idx]
-                    del event.participant_names[idx]
-                    update_event(conn,  "participant_names", col_str(event.participant_names), event.id)
-                    update_event(conn,  "participant_ids", col_str(event.participant_ids), event.id)
-                    update_event(conn,  "is_bench", col_str(event.is_bench), event.id)
-                    embed = make_event_embed(event, message.guild, True)
-                    await message.edit(embed=embed)
-                    # await user.send(f'You are now signed out of {event.id}!')
+            if event is not None:
+                event_id = event.id
+            else:
+                if not await is_event_message(conn, reaction.guild_id, reaction.message_id):
+                    # Reaction was not on an event post
                     conn.close()
-                    await message.remove_reaction(emoji, user)
                     return
-                elif emoji.name == emoji_dict['bench'].split(":")[1]:
-                    if event.is_bench[idx] == 0:
-                        # person is not benched and wants to be benched
-                        # if it is already 1, person is already benched, nothing happens
-                        event.is_bench[idx] = 1
-                        update_event(conn, "is_bench", col_str(event.is_bench), event.id)
-                        embed = make_event_embed(event, message.guild, True)
-                        await message.edit(embed=embed)
-                        conn.close()
-                        await message.remove_reaction(emoji, user)
-                        return
-                elif emoji.name == emoji_dict['sign_in'].split(":")[1]:
-                    if event.is_bench[idx] == 1:
-                        # person is benched and wants to be signed up normally
-                        # if it is already 0, person is already signed up, nothing happens
-                        event.is_bench[idx] = 0
-                        update_event(conn, "is_bench", col_str(event.is_bench), event.id)
-                        embed = make_event_embed(event, message.guild, True)
-                        await message.edit(embed=embed)
-                        conn.close()
-                        await message.remove_reaction(emoji, user)
-                        return
-            else:
-                # user not in list yet
-                if not emoji.name == emoji_dict['sign_out'].split(":")[1]:  # if they aren't signed in, "sign_out" will not do anything
-                    db_player = get_player_by_id(conn, user.id)
-                    if not db_player:
-                        # user also not in db
-                        await user.send(f'You are trying to sign in to Event {event.id}, '
-                                        f'but you are not registered yet! '
-                                        f'Please register with $register-character on your server')
-                        conn.close()
-                        await message.remove_reaction(emoji, user)
-                        return
-                    chara, _, _ = make_character_from_db(conn, user.id, None)
-                    if emoji.name == emoji_dict['sign_in'].split(":")[1]:
-                        bench = 0
-                    else:
-                        bench = 1
-                    event.participant_names.append(chara.character_name)
-                    event.participant_ids.append(chara.discord_id)
-                    event.is_bench.append(bench)
-                    update_event(conn, "participant_names", col_str(event.participant_names), event.id)
-                    update_event(conn, "participant_ids", col_str(event.participant_ids), event.id)
-                    update_event(conn, "is_bench", col_str(event.is_bench), event.id)
-                    embed = make_event_embed(event, message.guild, True)
-                    await message.edit(embed=embed)
-                    # await user.send(f'You are now signed in for {event.id}!')
+                db_ev = await conn.get_event_by_message(reaction.message_id)
+                if not db_ev:
                     conn.close()
-                    await message.remove_reaction(emoji, user)
                     return
+                event_id = db_ev[0][0]
 
-            # await user.send(f'You are trying to sign in to Event {event.id}!')
+            status, event = await change_roster(conn, reaction.guild_id, event_id, user.id, actions[emoji.name])
             conn.close()
+            if status == "closed":
+                await user.send(f'You are trying to sign in/out for Event {event.id}, '
+                                f'but the recruitment has ended.')
+            elif status == "unregistered":
+                await user.send(f'You are trying to sign in to Event {event.id}, '
+                                f'but you are not registered yet! '
+                                f'Please register with $register-character on your server')
+            elif status == "changed":
+                schedule_event_render(event, message)
             await message.remove_reaction(emoji, user)
             return
         else:
@@ -926,6 +1156,11 @@ async def on_raw_reaction_add(reaction):
         return
 
 
+@bot.event
+async def on_command(ctx):
+    shard_load["commands"] += 1
+
+
 @bot.event
 async def on_command_error(ctx, error):
     # adapted from RemixBot https://github.com/cree-py/RemixBot
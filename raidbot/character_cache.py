@@ -0,0 +1,46 @@
+import copy
+from collections import OrderedDict
+
+from raidbot.raidbuilder import make_character_from_db
+
+
+class CharacterCache:
+    """LRU cache of make_character_from_db results, keyed by (guild id, discord id).
+    Whoever changes a player in the database has to invalidate() it afterwards. Callers get their own copy of the
+    Character, so changing it (e.g. its job list before it is validated) does not change the cached one."""
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (guild id, discord id) -> (Character, signup_date, num_raids)
+
+    async def get(self, conn, guild_id, discord_id, name=None):
+        """(Character, signup_date, num_raids) like make_character_from_db, with conn being an AsyncDatabase"""
+        key = (guild_id, discord_id)
+        entry = self._entries.get(key)
+        if entry is not None and (name is None or entry[0].character_name == name):
+            self.hits += 1
+            self._entries.move_to_end(key)
+        else:
+            self.misses += 1
+            entry = await conn.run(make_character_from_db, discord_id, name)
+            # A player can have several characters, the lookup by id alone is the one that is cached
+            if name is None:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        chara, signup_date, num_raids = entry
+        return self._copy(chara), signup_date, num_raids
+
+    @staticmethod
+    def _copy(chara):
+        chara = copy.copy(chara)
+        chara.jobs = list(chara.jobs)
+        return chara
+
+    def invalidate(self, guild_id, discord_id):
+        self._entries.pop((guild_id, discord_id), None)
+
+    def __len__(self):
+        return len(self._entries)
@@ -3,17 +3,50 @@ from sqlite3 import Error
 from pathlib import Path
 from datetime import datetime
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from tqdm import tqdm
 
 PLAYER_COLUMNS = ["discord_id", "character_name", "jobs", "signup_date", "num_raids", "involuntary_benches"]
 PLAYER_COLUMNS_TYPES = ["integer NOT NULL", "text NOT NULL", "text", "text", "integer", "integer"]
+PLAYER_COUNTERS = ["num_raids", "involuntary_benches"]
 
-EVENT_COLUMNS = ["name", "timestamp", "participant_names", "participant_ids", "is_bench", "jobs", "role_numbers", "creator_id", "message_link", "state"]
-EVENT_COLUMNS_TYPES = ["text NOT NULL", "integer NOT NULL", "text", "text", "text", "text",  "text", "integer NOT NULL", "text", "text NOT NULL"]
+EVENT_COLUMNS = ["name", "timestamp", "participant_names", "participant_ids", "is_bench", "jobs", "role_numbers", "creator_id", "message_link", "state",
+                 "guild_id", "channel_id", "message_id"]
+EVENT_COLUMNS_TYPES = ["text NOT NULL", "integer NOT NULL", "text", "text", "text", "text",  "text", "integer NOT NULL", "text", "text NOT NULL",
+                       "integer", "integer", "integer"]
+
+# The roster of an event, one row per signed up character in sign-up order. The participant_names, participant_ids,
+# is_bench and jobs columns of events are only read by migrate_event_participants, which moves them here.
+PARTICIPANT_COLUMNS = ["event_id", "discord_id", "character_name", "is_bench", "job", "position"]
+PARTICIPANT_COLUMNS_TYPES = ["integer NOT NULL", "integer NOT NULL", "text NOT NULL", "integer NOT NULL", "text",
+                             "integer NOT NULL"]
 
 SERVER_INFO_COLUMNS = ["key", "value"]
 SERVER_INFO_COLUMNS_TYPES = ["text", "text"]
 
+# Secondary indexes, created by the "secondary indexes" migration
+INDEXES = {
+    "players_discord_id": "players(discord_id, character_name)",
+    "players_character_name": "players(character_name)",
+    "server_info_key": "server_info(key)",
+    "events_state": "events(state, timestamp)",
+    "event_participants_event": "event_participants(event_id, discord_id)",
+    "event_participants_player": "event_participants(discord_id)",
+}
+
+# Applied to every connection by create_connection. In WAL mode a commit appends to the log instead of rewriting a
+# rollback journal, and with synchronous=NORMAL it is only fsynced on checkpoints: the database stays consistent,
+# but a power loss can drop the last few commits.
+CONNECTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # negative means KiB, so ~16 MB of page cache
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
 
 def col_str(col_list):
     col_string = ""
@@ -30,6 +63,38 @@ def create_table_sql_command(name, cols, col_types):
     return sql_table
 
 
+def insert_sql_command(name, cols):
+    question_str = col_str(["?" for _ in cols])
+    return f"INSERT INTO {name}({col_str(cols)}) VALUES({question_str})"
+
+
+@lru_cache(maxsize=None)
+def update_sql_command(name, fields: tuple, key_cols: tuple):
+    """UPDATE of the given fields of table `name` for the rows matching key_cols, built once per combination.
+    sqlite3 keeps the compiled statements of a connection keyed by their text, so using the same string again
+    also skips preparing the statement."""
+    set_str = col_str([f"{f} = ?" for f in fields])
+    where_str = " AND ".join(f"{k} = ?" for k in key_cols)
+    return f"UPDATE {name} SET {set_str} WHERE {where_str}"
+
+
+@lru_cache(maxsize=None)
+def increment_sql_command(name, field, key_cols: tuple):
+    """UPDATE adding to the counter `field` of the rows of table `name` matching key_cols, built once per field"""
+    where_str = " AND ".join(f"{k} = ?" for k in key_cols)
+    return f"UPDATE {name} SET {field} = COALESCE({field}, 0) + ? WHERE {where_str}"
+
+
+INSERT_PLAYER_SQL = insert_sql_command("players", PLAYER_COLUMNS)
+INSERT_EVENT_SQL = insert_sql_command("events", EVENT_COLUMNS)
+INSERT_SERVER_INFO_SQL = insert_sql_command("server_info", SERVER_INFO_COLUMNS)
+INSERT_PARTICIPANT_SQL = insert_sql_command("event_participants", PARTICIPANT_COLUMNS)
+# Appends a participant behind everyone signed up so far
+APPEND_PARTICIPANT_SQL = f"""INSERT INTO event_participants({col_str(PARTICIPANT_COLUMNS)})
+                             SELECT ?, ?, ?, ?, NULL, COALESCE(MAX(position) + 1, 0)
+                             FROM event_participants WHERE event_id = ?"""
+
+
 def initialize_db_with_tables(conn):
     sql_create_player_table_str: str = create_table_sql_command("players", PLAYER_COLUMNS, PLAYER_COLUMNS_TYPES)
     sql_create_events_table_str: str = create_table_sql_command("events", EVENT_COLUMNS, EVENT_COLUMNS_TYPES)
@@ -39,6 +104,159 @@ def initialize_db_with_tables(conn):
     create_table(conn, sql_create_events_table_str)
     create_table(conn, sql_create_server_table_str)
 
+    migrate(conn)
+
+
+def get_schema_version(conn):
+    """Version of the schema a database was migrated to, 0 for databases from before versioning"""
+    rows = get_server_info(conn, "schema_version")
+    return int(rows[0][2]) if rows else 0
+
+
+def set_schema_version(conn, version: int):
+    if get_server_info(conn, "schema_version"):
+        update_server_info(conn, "schema_version", str(version))
+    else:
+        create_server_info(conn, "schema_version", str(version))
+
+
+def migrate(conn):
+    """
+    Applies the MIGRATIONS a database has not seen yet, each in its own transaction together with the new
+    schema version, so a failing step leaves the database at the previous version
+    :return: the schema version of the database afterwards
+    """
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        print(f"Database has schema version {version}, newer than {SCHEMA_VERSION} of this bot")
+    for step_version, description, step in MIGRATIONS:
+        if step_version > version:
+            with transaction(conn):
+                step(conn)
+                set_schema_version(conn, step_version)
+            version = step_version
+    return version
+
+
+def message_ids_from_link(message_link):
+    """(guild_id, channel_id, message_id) of a discord message link, or (None, None, None) if it is not one"""
+    try:
+        guild_id, channel_id, message_id = message_link.split('/')[-3:]
+        return int(guild_id), int(channel_id), int(message_id)
+    except (AttributeError, ValueError):
+        return None, None, None
+
+
+def migrate_event_message_ids(conn):
+    """Adds the guild_id, channel_id and message_id columns to an events table made before they existed,
+    fills them from message_link, and indexes message_id for get_event_by_message"""
+    cur = conn.cursor()
+    cur.execute("PRAGMA table_info(events)")
+    existing = [row[1] for row in cur.fetchall()]
+    missing = [c for c in ["guild_id", "channel_id", "message_id"] if c not in existing]
+    for c in missing:
+        cur.execute(f"ALTER TABLE events ADD COLUMN {c} integer")
+    if missing:
+        cur.execute("SELECT id, message_link FROM events WHERE message_link IS NOT NULL")
+        rows = [(*message_ids_from_link(link), ev_id) for ev_id, link in cur.fetchall()]
+        cur.executemany("UPDATE events SET guild_id = ?, channel_id = ?, message_id = ? WHERE id = ?", rows)
+    cur.execute("CREATE INDEX IF NOT EXISTS events_message_id ON events(message_id)")
+    _commit(conn)
+
+
+def create_event_participants(conn):
+    conn.execute(create_table_sql_command("event_participants", PARTICIPANT_COLUMNS, PARTICIPANT_COLUMNS_TYPES))
+    migrate_event_participants(conn)
+
+
+def create_indexes(conn):
+    for name, columns in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+
+
+# Steps from one schema version to the next, in order; append new ones at the end. Databases from before versioning
+# are at version 0 but may have had some of these changes applied already, so the steps check what is there.
+MIGRATIONS = [
+    (1, "message ids of event posts", migrate_event_message_ids),
+    (2, "event_participants table", create_event_participants),
+    (3, "secondary indexes", create_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def list_guild_databases():
+    """Guild ids of all guild databases in ./database/"""
+    return [int(path.stem) for path in Path("./database/").glob("*.db") if path.stem.isdigit()]
+
+
+_transaction_depth = {}  # id(conn) -> number of transaction() blocks open on it
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Groups the changes made inside the block into one atomic commit:
+        with transaction(conn):
+            update_player(conn, "num_raids", 3, discord_id, character_name)
+            update_event_fields(conn, {"jobs": jobs, "state": "COMPLETE"}, event_id)
+    The functions of this module do not commit on their own inside the block. If the block raises,
+    everything it changed is rolled back. Blocks may be nested, only the outermost one commits.
+    """
+    key = id(conn)
+    _transaction_depth[key] = _transaction_depth.get(key, 0) + 1
+    try:
+        if _transaction_depth[key] == 1 and not conn.in_transaction:
+            # sqlite3 only opens a transaction by itself before INSERT/UPDATE/DELETE, this way CREATE and ALTER
+            # statements are rolled back as well
+            conn.execute("BEGIN")
+        yield conn
+        if _transaction_depth[key] == 1:
+            conn.commit()
+    except BaseException:
+        if _transaction_depth[key] == 1:
+            conn.rollback()
+        raise
+    finally:
+        _transaction_depth[key] -= 1
+        if not _transaction_depth[key]:
+            del _transaction_depth[key]
+
+
+def _commit(conn):
+    """Commit, unless the change is part of a transaction() that commits once it is done"""
+    if id(conn) not in _transaction_depth:
+        conn.commit()
+
+
+def configure_connection(conn):
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def roster_rows(event_id, participant_ids, participant_names, is_bench, jobs=None):
+    """event_participants rows of a roster given as the lists of an Event"""
+    jobs = jobs or [None for _ in participant_ids]
+    return [(event_id, int(p_id), name, int(bench), job if job not in ("", "None") else None, position)
+            for position, (p_id, name, bench, job) in enumerate(zip(participant_ids, participant_names, is_bench, jobs))]
+
+
+def migrate_event_participants(conn):
+    """Moves rosters still stored as comma separated strings in the events table into event_participants"""
+    cur = conn.cursor()
+    cur.execute("SELECT id, participant_ids, participant_names, is_bench, jobs FROM events "
+                "WHERE participant_ids IS NOT NULL AND participant_ids != ''")
+    rows = []
+    for ev_id, participant_ids, participant_names, is_bench, jobs in cur.fetchall():
+        rows += roster_rows(ev_id, participant_ids.split(","), (participant_names or "").split(","),
+                            (is_bench or "").split(","), jobs.split(",") if jobs else None)
+    if rows:
+        with transaction(conn):
+            migrated = list({(row[0],) for row in rows})
+            cur.executemany("DELETE FROM event_participants WHERE event_id = ?", migrated)
+            cur.executemany(INSERT_PARTICIPANT_SQL, rows)
+            cur.executemany("UPDATE events SET participant_names = NULL, participant_ids = NULL, is_bench = NULL, "
+                            "jobs = NULL WHERE id = ?", migrated)
+
 
 def create_connection(db_file: str):
     """ create a database connection to a SQLite database """
@@ -46,6 +264,7 @@ def create_connection(db_file: str):
     try:
         Path("./database/").mkdir(parents=True, exist_ok=True)
         conn = sqlite3.connect("./database/" + str(db_file) + r".db")
+        configure_connection(conn)
 
     except Error as e:
         print(e)
@@ -55,6 +274,84 @@ def create_connection(db_file: str):
     return conn
 
 
+class PooledConnection:
+    """A handle to a connection shared through a ConnectionPool.
+    Behaves like the connection itself, but close() hands it back to the pool instead of closing it."""
+    _pool = None
+    _conn = None
+
+    def __init__(self, pool, key, conn):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return self._conn.__exit__(exc_type, exc_val, exc_tb)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.release(self._key)
+            self._pool = None
+
+    def __del__(self):
+        # A handler that failed halfway must not keep its guild's connection pinned forever
+        self.close()
+
+
+class ConnectionPool:
+    """Keeps one open connection per guild and hands out shared handles to it, instead of opening and closing
+    a connection for every command and reaction.
+    Connections without handles are closed again, least recently used first, when more than max_open are open.
+    Handles are meant to be taken and closed on the event loop, so no extra locking is needed."""
+    def __init__(self, open_connection=create_connection, max_open=32):
+        self._open_connection = open_connection
+        self.max_open = max_open
+        self._connections = OrderedDict()
+        self._users = {}
+
+    def get(self, key):
+        """Handle to the connection for key (the guild id), or None if it could not be opened"""
+        conn = self._connections.get(key)
+        if conn is None:
+            conn = self._open_connection(key)
+            if conn is None:
+                return None
+            self._connections[key] = conn
+            self._users[key] = 0
+        self._connections.move_to_end(key)
+        self._users[key] += 1
+        self._evict()
+        return PooledConnection(self, key, conn)
+
+    def release(self, key):
+        if key in self._users:  # might have been closed by close_all in the meantime
+            self._users[key] -= 1
+            self._evict()
+
+    def _evict(self):
+        for key in list(self._connections):  # least recently used first
+            if len(self._connections) <= self.max_open:
+                break
+            if self._users[key] == 0:
+                self._connections.pop(key).close()
+                del self._users[key]
+
+    def close_all(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+        self._users.clear()
+
+    def __len__(self):
+        return len(self._connections)
+
+
 def create_table(conn, create_table_sql: str):
     """ create a table from the create_table_sql statement
     :param conn: Connection object
@@ -75,13 +372,9 @@ def create_player(conn, player: str):
     :param player:
     :return: player id
     """
-    player_col_str = col_str(PLAYER_COLUMNS)
-    question_str = col_str(["?" for _ in PLAYER_COLUMNS])
-    sql = f''' INSERT INTO players({player_col_str})
-              VALUES({question_str}) '''
     cur = conn.cursor()
-    cur.execute(sql, player)
-    conn.commit()
+    cur.execute(INSERT_PLAYER_SQL, player)
+    _commit(conn)
     return cur.lastrowid
 
 
@@ -106,6 +399,18 @@ def get_player_by_name(conn, name):
     return cur.fetchall()
 
 
+def get_players_by_ids(conn, discord_ids):
+    """Find all players with one of the given discord ids, with one query per 500 ids"""
+    discord_ids = list(set(discord_ids))
+    rows = []
+    cur = conn.cursor()
+    for i in range(0, len(discord_ids), 500):
+        chunk = discord_ids[i:i + 500]
+        cur.execute(f"SELECT * FROM players WHERE discord_id IN ({col_str(['?' for _ in chunk])})", chunk)
+        rows += cur.fetchall()
+    return rows
+
+
 def update_player(conn, field, value, discord_id: int, character_name: str):
     """
     update character_name, jobs, num_raids of a character
@@ -114,17 +419,46 @@ def update_player(conn, field, value, discord_id: int, character_name: str):
     :return: discord id
     """
     if field in PLAYER_COLUMNS:
-        sql = f''' UPDATE players
-                   SET {field} = ?
-                   WHERE discord_id = ?
-                   AND character_name = ?'''
+        sql = update_sql_command("players", (field,), ("discord_id", "character_name"))
         cur = conn.cursor()
         cur.execute(sql, (value, discord_id, character_name))
-        conn.commit()
+        _commit(conn)
     else:
         print(f"{field} not in players columns")
 
 
+def update_player_fields(conn, fields: dict, discord_id: int, character_name: str):
+    """
+    update several fields of a character with one statement
+    :param conn:
+    :param fields: column -> new value
+    """
+    unknown = [f for f in fields if f not in PLAYER_COLUMNS]
+    if unknown:
+        print(f"{col_str(unknown)} not in players columns")
+    elif fields:
+        sql = update_sql_command("players", tuple(fields), ("discord_id", "character_name"))
+        cur = conn.cursor()
+        cur.execute(sql, (*fields.values(), discord_id, character_name))
+        _commit(conn)
+
+
+def increment_player_counter(conn, field, players, amount=1):
+    """
+    add amount to a counter of many characters at once, in SQL so concurrent changes are not overwritten
+    :param conn:
+    :param field: one of PLAYER_COUNTERS
+    :param players: (discord_id, character_name) of each character
+    """
+    if field in PLAYER_COUNTERS:
+        sql = increment_sql_command("players", field, ("discord_id", "character_name"))
+        cur = conn.cursor()
+        cur.executemany(sql, [(amount, discord_id, character_name) for discord_id, character_name in players])
+        _commit(conn)
+    else:
+        print(f"{field} not in players counters")
+
+
 def update_jobs(conn, job_list, discord_id, character_name):
     update_player(conn, "jobs", job_list, discord_id, character_name)
 
@@ -140,7 +474,7 @@ def delete_player(conn, id, name):
     sql = 'DELETE FROM players WHERE discord_id=? AND character_name=?'
     cur = conn.cursor()
     cur.execute(sql, (id, name))
-    conn.commit()
+    _commit(conn)
 
 
 def delete_all_players(conn):
@@ -152,7 +486,7 @@ def delete_all_players(conn):
     sql = 'DELETE FROM players'
     cur = conn.cursor()
     cur.execute(sql)
-    conn.commit()
+    _commit(conn)
 
 
 def create_event(conn, event):
@@ -162,13 +496,9 @@ def create_event(conn, event):
     :param event:
     :return: player id
     """
-    event_col_str = col_str(EVENT_COLUMNS)
-    question_str = col_str(["?" for _ in EVENT_COLUMNS])
-    sql = f''' INSERT INTO events({event_col_str})
-               VALUES({question_str}) '''
     cur = conn.cursor()
-    cur.execute(sql, event)
-    conn.commit()
+    cur.execute(INSERT_EVENT_SQL, event)
+    _commit(conn)
     return cur.lastrowid
 
 
@@ -186,6 +516,77 @@ def find_events(conn, field, value):
     return cur.fetchall()
 
 
+def get_event_by_message(conn, message_id):
+    """Find the event posted as the message with the given id"""
+    cur = conn.cursor()
+    cur.execute(f"SELECT * FROM events WHERE message_id=?", (message_id,))
+    return cur.fetchall()
+
+
+def get_event_message_ids(conn):
+    """Ids of all messages that events were posted as"""
+    cur = conn.cursor()
+    cur.execute("SELECT message_id FROM events WHERE message_id IS NOT NULL")
+    return [row[0] for row in cur.fetchall()]
+
+
+def set_event_message(conn, event_id, message_link):
+    """Store the link and ids of the message an event was posted as"""
+    sql = ''' UPDATE events
+              SET message_link = ?, guild_id = ?, channel_id = ?, message_id = ?
+              WHERE id = ?'''
+    cur = conn.cursor()
+    cur.execute(sql, (message_link, *message_ids_from_link(message_link), event_id))
+    _commit(conn)
+
+
+def get_event_participants(conn, event_id):
+    """(discord_id, character_name, is_bench, job) of everyone signed up for an event, in sign-up order"""
+    cur = conn.cursor()
+    cur.execute("SELECT discord_id, character_name, is_bench, job FROM event_participants WHERE event_id=? "
+                "ORDER BY position", (event_id,))
+    return cur.fetchall()
+
+
+def get_events_of_player(conn, discord_id):
+    """Find the events a player is signed up for"""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM events WHERE id IN (SELECT event_id FROM event_participants WHERE discord_id=?)",
+                (discord_id,))
+    return cur.fetchall()
+
+
+def add_participant(conn, event_id, discord_id, character_name, is_bench):
+    """Sign a character up for an event, behind everyone signed up so far"""
+    cur = conn.cursor()
+    cur.execute(APPEND_PARTICIPANT_SQL, (event_id, discord_id, character_name, is_bench, event_id))
+    _commit(conn)
+
+
+def remove_participant(conn, event_id, discord_id):
+    """Sign a player out of an event"""
+    sql = 'DELETE FROM event_participants WHERE event_id=? AND discord_id=?'
+    cur = conn.cursor()
+    cur.execute(sql, (event_id, discord_id))
+    _commit(conn)
+
+
+def set_participant_bench(conn, event_id, discord_id, is_bench):
+    """Move a participant onto (1) or off (0) the substitute bench"""
+    sql = update_sql_command("event_participants", ("is_bench",), ("event_id", "discord_id"))
+    cur = conn.cursor()
+    cur.execute(sql, (is_bench, event_id, discord_id))
+    _commit(conn)
+
+
+def set_event_roster(conn, event_id, participant_ids, participant_names, is_bench, jobs=None):
+    """Replace the whole roster of an event, e.g. once it is closed and sorted by job"""
+    with transaction(conn):
+        cur = conn.cursor()
+        cur.execute("DELETE FROM event_participants WHERE event_id=?", (event_id,))
+        cur.executemany(INSERT_PARTICIPANT_SQL, roster_rows(event_id, participant_ids, participant_names, is_bench, jobs))
+
+
 def get_event(conn, event_id):
     """Find event given id"""
     cur = conn.cursor()
@@ -193,6 +594,13 @@ def get_event(conn, event_id):
     return cur.fetchall()
 
 
+def get_events_by_state(conn, state):
+    """Find all events in the given state, e.g. RECRUITING"""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM events WHERE state=?", (state,))
+    return cur.fetchall()
+
+
 def get_last_x_events(conn, x: int):
     """Returns the x latest events"""
     sql = ''' SELECT * FROM events
@@ -200,7 +608,7 @@ def get_last_x_events(conn, x: int):
               LIMIT ?'''
     cur = conn.cursor()
     cur.execute(sql, (x,))
-    conn.commit()
+    _commit(conn)
     return cur.fetchall()
 
 
@@ -211,16 +619,30 @@ def update_event(conn, field, value, event_id):
     :param field:
     """
     if field in EVENT_COLUMNS:
-        sql = f''' UPDATE events
-                   SET {field} = ?
-                   WHERE id = ?'''
+        sql = update_sql_command("events", (field,), ("id",))
         cur = conn.cursor()
         cur.execute(sql, (value, event_id))
-        conn.commit()
+        _commit(conn)
     else:
         print(f"{field} not in events columns")
 
 
+def update_event_fields(conn, fields: dict, event_id):
+    """
+    update several fields of an event with one statement, e.g. all lists of its roster
+    :param conn:
+    :param fields: column -> new value
+    """
+    unknown = [f for f in fields if f not in EVENT_COLUMNS]
+    if unknown:
+        print(f"{col_str(unknown)} not in events columns")
+    elif fields:
+        sql = update_sql_command("events", tuple(fields), ("id",))
+        cur = conn.cursor()
+        cur.execute(sql, (*fields.values(), event_id))
+        _commit(conn)
+
+
 def delete_event(conn, event_id):
     """
     Delete an event by id
@@ -231,7 +653,8 @@ def delete_event(conn, event_id):
     sql = 'DELETE FROM events WHERE id=?'
     cur = conn.cursor()
     cur.execute(sql, (event_id,))
-    conn.commit()
+    cur.execute('DELETE FROM event_participants WHERE event_id=?', (event_id,))
+    _commit(conn)
 
 
 def delete_all_events(conn):
@@ -243,7 +666,8 @@ def delete_all_events(conn):
     sql = 'DELETE FROM events'
     cur = conn.cursor()
     cur.execute(sql)
-    conn.commit()
+    cur.execute('DELETE FROM event_participants')
+    _commit(conn)
 
 
 def get_server_info(conn, key):
@@ -257,13 +681,9 @@ def create_server_info(conn, key, value):
     """
     Create a new info into the server_info table
     """
-    info_col_str = col_str(SERVER_INFO_COLUMNS)
-    question_str = col_str(["?" for _ in SERVER_INFO_COLUMNS])
-    sql = f''' INSERT INTO server_info({info_col_str})
-               VALUES({question_str}) '''
     cur = conn.cursor()
-    cur.execute(sql, (key, value))
-    conn.commit()
+    cur.execute(INSERT_SERVER_INFO_SQL, (key, value))
+    _commit(conn)
     return cur.lastrowid
 
 
@@ -271,12 +691,10 @@ def update_server_info(conn, key, value):
     """
     update an entry of server_info
     """
-    sql = f''' UPDATE server_info
-               SET value = ?
-               WHERE key = ?'''
+    sql = update_sql_command("server_info", ("value",), ("key",))
     cur = conn.cursor()
     cur.execute(sql, (value, key))
-    conn.commit()
+    _commit(conn)
     return
 
 
@@ -296,6 +714,9 @@ if __name__ == '__main__':
         create_table(conn, sql_create_player_table)
         # create Events table
         create_table(conn, sql_create_events_table)
+        # create table of event rosters
+        create_table(conn, create_table_sql_command("event_participants", PARTICIPANT_COLUMNS,
+                                                    PARTICIPANT_COLUMNS_TYPES))
 
         # delete table (for testing purposes)
         delete_all_players(conn)
@@ -329,15 +750,13 @@ if __name__ == '__main__':
         # create a new Event
         for i in tqdm(range(100)):
             event = ("Expert Roulette", int(time.time()), "A,B,C,D", "1,2,3,4", "0,0,0,0",
-                     "PLD,SCH,MNK,RDM", "1,1,2", 205335642287112192, None,  "COMPLETED")
+                     "PLD,SCH,MNK,RDM", "1,1,2", 205335642287112192, None,  "COMPLETED", None, None, None)
             create_event(conn, event)
 
         # update event
         update_event(conn, "name", "Leviathan (Unreal)", 3)
-        update_event(conn, "participant_names", "A,B,C,D,E,F,G,H", 3)
-        update_event(conn, "participant_ids", "1,2,3,4,5,6,7,8", 3)
-        update_event(conn, "is_bench", col_str(["0" for _ in range(8)]), 3)
-        update_event(conn, "jobs", "PLD,DRK,WHM,SCH,DRG,SAM,BLM,BRD", 3)
+        set_event_roster(conn, 3, [1, 2, 3, 4, 5, 6, 7, 8], ["A", "B", "C", "D", "E", "F", "G", "H"], [0] * 8,
+                         ["PLD", "DRK", "WHM", "SCH", "DRG", "SAM", "BLM", "BRD"])
         update_event(conn, "role_numbers", "2,2,4", 3)
         update_event(conn, "state", "CANCELLED", 5)
 
@@ -3,12 +3,12 @@ from pytz import timezone
 from pytz.exceptions import UnknownTimeZoneError
 
 from raidbot.raidbuilder import job_string_to_list, string_from_list
-from raidbot.database import get_event, create_connection
+from raidbot.database import get_event, get_event_participants, get_events_by_state, create_connection
 
 
 class Event:
     def __init__(self, ev_id, name, timestamp, participant_names, participant_ids, is_bench,
-                 jobs, role_numbers, creator_id, message_link, state):
+                 jobs, role_numbers, creator_id, message_link, state, guild_id=None, channel_id=None, message_id=None):
         self.id = ev_id
         self.name = name
         self.timestamp = timestamp
@@ -56,6 +56,9 @@ class Event:
         self.creator_id = creator_id
         self.message_link = message_link
         self.state = state
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
 
     def get_time(self, user_timezone='UTC'):
         """Get timestamp in user_timezone, user_timezone uses formats known to pytz"""
@@ -104,10 +107,26 @@ class Event:
 
 def make_event_from_db(conn, event_id):
     db_event = get_event(conn, event_id)
-    event = Event(*db_event[0])
+    return make_event_from_row(conn, db_event[0])
+
+
+def make_event_from_row(conn, db_event_row):
+    """Event of a row of the events table, with its roster loaded from event_participants"""
+    event = Event(*db_event_row)
+    participants = get_event_participants(conn, event.id)
+    event.participant_ids = [p[0] for p in participants]
+    event.participant_names = [p[1] for p in participants]
+    event.is_bench = [p[2] for p in participants]
+    # Jobs are only assigned once an event is closed
+    jobs = [p[3] for p in participants]
+    event.jobs = jobs if any(jobs) else []
     return event
 
 
+def make_events_in_state(conn, state):
+    return [make_event_from_row(conn, row) for row in get_events_by_state(conn, state)]
+
+
 if __name__ == '__main__':
     # Testing functionality
     conn = create_connection(r"database/test.db")
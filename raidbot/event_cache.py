@@ -0,0 +1,43 @@
+class EventCache:
+    """Write-through cache of the events that are still RECRUITING, keyed by event id and by the id of their post.
+    Handlers change the cached Event and persist the same change to the database right away, so both stay in step.
+    Events that stop recruiting are evicted, they are rarely looked at again."""
+    def __init__(self):
+        self._events = {}  # (guild id, event id) -> Event
+        self._by_message = {}  # (guild id, message id) -> event id
+        self.warmed = set()  # ids of the guilds whose recruiting events were all loaded
+
+    def get(self, guild_id, event_id):
+        try:
+            return self._events.get((guild_id, int(event_id)))
+        except (TypeError, ValueError):
+            return None
+
+    def get_by_message(self, guild_id, message_id):
+        event_id = self._by_message.get((guild_id, message_id))
+        return None if event_id is None else self._events[(guild_id, event_id)]
+
+    def put(self, guild_id, event):
+        """Caches the event, or evicts it if it is not recruiting (anymore)"""
+        if event.state != "RECRUITING":
+            self.evict(guild_id, event.id)
+            return
+        self._events[(guild_id, event.id)] = event
+        if event.message_id is not None:
+            self._by_message[(guild_id, event.message_id)] = event.id
+
+    def evict(self, guild_id, event_id):
+        event = self._events.pop((guild_id, event_id), None)
+        if event is not None and event.message_id is not None:
+            self._by_message.pop((guild_id, event.message_id), None)
+
+    def warm(self, guild_id, events):
+        """Caches all recruiting events of a guild, e.g. at startup.
+        Events cached in the meantime are kept, a handler might be changing them right now."""
+        for event in events:
+            if self.get(guild_id, event.id) is None:
+                self.put(guild_id, event)
+        self.warmed.add(guild_id)
+
+    def __len__(self):
+        return len(self._events)
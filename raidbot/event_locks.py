@@ -0,0 +1,30 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class LockRegistry:
+    """One asyncio.Lock per key, e.g. (guild id, event id), so changes of the same event run one after another while
+    other events go on in parallel. A lock only exists while someone holds it or waits for it."""
+    def __init__(self):
+        self._locks = {}  # key -> [lock, number of holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def locked(self, key):
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    def __len__(self):
+        return len(self._locks)
@@ -0,0 +1,99 @@
+"""Vectorized scoring backend for the exhaustive raid composition search.
+Needs numpy, which is optional and only imported when make_raid is called with backend="numpy"."""
+import math
+
+import numpy as np
+
+from raidbot.raidbuilder import Character, JOBS, JOB_IDS, TANKS, HEALERS, DPS, MELEES, RANGED, CASTERS, \
+    member_job_scores, combinations_by_prefix, group_progress_share, RoleFeasibility, roles_of, \
+    twin_positions
+
+
+def _role_lookup(role_jobs):
+    lookup = np.zeros(len(JOBS), dtype=bool)
+    lookup[[JOB_IDS[job] for job in role_jobs]] = True
+    return lookup
+
+
+IS_TANK = _role_lookup(TANKS)
+IS_HEALER = _role_lookup(HEALERS)
+IS_DPS = _role_lookup(DPS)
+IS_MELEE = _role_lookup(MELEES)
+IS_RANGED = _role_lookup(RANGED)
+IS_CASTER = _role_lookup(CASTERS)
+
+
+def encode_characters(characters: list[Character], use_benched_counter=True):
+    """Job ids and job scores of every character as (n_characters, max_jobs) matrices, padded with -1 and 0"""
+    max_jobs = max(len(member.jobs) for member in characters)
+    job_ids = np.full((len(characters), max_jobs), -1, dtype=np.int64)
+    job_scores = np.zeros((len(characters), max_jobs), dtype=np.int64)
+    for i, member in enumerate(characters):
+        job_ids[i, :len(member.jobs)] = member.job_ids
+        job_scores[i, :len(member.jobs)] = member_job_scores(member, use_benched_counter)
+    return job_ids, job_scores
+
+
+def score_products(members, job_counts, job_ids, job_scores, n_tanks: int, n_healers: int, n_dps: int,
+                   no_double_jobs=True, maximize_diverse_dps=True):
+    """Scores every job product of one group at once, the same way calc_composition_score does.
+    Returns the products as (n_products, n_members) job indices, in itertools.product order, and their scores."""
+    comp_idx = np.indices(job_counts).reshape(len(members), -1).T
+    picked = job_ids[members, comp_idx]
+    member_sum = job_scores[members, comp_idx].sum(axis=1)
+
+    # Roles are counted by distinct jobs, like the `t in picked_jobs` checks of calc_composition_score
+    present = np.zeros((len(picked), len(JOBS)), dtype=bool)
+    present[np.arange(len(picked))[:, None], picked] = True
+    feasible = ((present[:, IS_TANK].sum(axis=1) == n_tanks)
+                & (present[:, IS_HEALER].sum(axis=1) == n_healers)
+                & (present[:, IS_DPS].sum(axis=1) == n_dps))
+
+    bonus = np.zeros(len(picked), dtype=np.int64)
+    if no_double_jobs:
+        bonus -= 8 * (present.sum(axis=1) != len(members))
+    if maximize_diverse_dps:
+        dps_types = (present[:, IS_MELEE].any(axis=1).astype(np.int64)
+                     + present[:, IS_RANGED].any(axis=1)
+                     + present[:, IS_CASTER].any(axis=1))
+        bonus += np.select([dps_types == 3, dps_types == 2], [4, 2], 0)
+
+    return comp_idx, np.where(feasible, member_sum + bonus, 0)
+
+
+def exhaustive_candidates(characters: list[Character], n_tanks: int, n_healers: int, n_dps: int,
+                          no_double_jobs=True, maximize_diverse_dps=True, use_benched_counter=True, collector=None,
+                          prefixes=None, token=None, twins=None):
+    """Drop-in replacement for raidbuilder.exhaustive_candidates that scores each group's job products as one batch"""
+    n_raiders = n_tanks + n_healers + n_dps
+    job_ids, job_scores = encode_characters(characters, use_benched_counter)
+    group_share = group_progress_share(len(characters), n_raiders, prefixes)
+    feasible = RoleFeasibility(n_tanks, n_healers, n_dps)
+    member_roles = [roles_of(member.job_mask) for member in characters]
+
+    for group_idx in combinations_by_prefix(len(characters), n_raiders, prefixes):
+        if token:
+            token.check()
+            token.advance(group_share)
+        if twins:
+            pairs = twin_positions(group_idx, twins)
+            if pairs is None:
+                continue
+        job_counts = [len(characters[i].jobs) for i in group_idx]
+        group_mask = 0
+        for i in group_idx:
+            group_mask |= characters[i].job_mask
+        if not feasible([member_roles[i] for i in group_idx], group_mask):
+            if token:
+                token.count_pruned(math.prod(job_counts))
+            continue
+        members = np.array(group_idx)
+        comp_idx, scores = score_products(members, job_counts, job_ids, job_scores, n_tanks, n_healers, n_dps,
+                                          no_double_jobs, maximize_diverse_dps)
+        viable = scores > 0  # only yield viable combinations
+        if twins:
+            for k, p in pairs:
+                viable &= comp_idx[:, k] > comp_idx[:, p]
+        viable = np.flatnonzero(viable)
+        for comp, score in zip(comp_idx[viable].tolist(), scores[viable].tolist()):
+            yield (group_idx, tuple(comp)), score
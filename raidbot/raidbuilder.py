@@ -1,7 +1,13 @@
+import heapq
 import itertools
+import math
+import multiprocessing
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
-from raidbot.database import get_player, get_player_by_id, get_player_by_name
+from raidbot.database import get_player, get_player_by_id, get_player_by_name, get_players_by_ids
 
 TANKS = ["WAR", "PLD", "DRK", "GNB"]
 HEALERS = ["WHM", "SCH", "AST"]
@@ -11,7 +17,36 @@ CASTERS = ["BLM", "SMN", "RDM"]
 LIMITED = ["BLU"]
 DPS = [*MELEES, *RANGED, *CASTERS]
 JOBS = [*TANKS, *HEALERS, *DPS]
+ROLE_OF_JOB = {**{t: 0 for t in TANKS}, **{h: 1 for h in HEALERS}, **{d: 2 for d in DPS}}  # index into role numbers
 CLASSES = ["MRD", "GLD", "CNJ", "ACN", "PGL", "LNC", "ROG", "ARC", "THM"]
+CLASS_SET = frozenset(CLASSES)
+
+# Job registry: every job has an integer id (its position in JOBS, which is also the FF sort order) and a bit 1 << id.
+# A set of jobs is the OR of their bits, so role counts and role checks are bit operations.
+JOB_IDS = {job: i for i, job in enumerate(JOBS)}
+
+
+def jobs_mask(jobs):
+    mask = 0
+    for job in jobs:
+        mask |= 1 << JOB_IDS[job]
+    return mask
+
+
+TANK_MASK = jobs_mask(TANKS)
+HEALER_MASK = jobs_mask(HEALERS)
+DPS_MASK = jobs_mask(DPS)
+MELEE_MASK = jobs_mask(MELEES)
+RANGED_MASK = jobs_mask(RANGED)
+CASTER_MASK = jobs_mask(CASTERS)
+ROLE_MASKS = [TANK_MASK, HEALER_MASK, DPS_MASK]  # in order of the role numbers
+DIVERSITY_BONUS = [0, 0, 2, 4]  # by number of DPS types (melee, ranged, caster) in a composition
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(mask):
+        return bin(mask).count("1")
 
 
 def string_from_list(lt):
@@ -43,17 +78,30 @@ class Character:
         self.involuntary_benches = involuntary_benches
 
     def set_jobs(self, job_list):
-        self.jobs = []
+        """Sets the jobs and the lookup tables derived from them. Change jobs only through here, or they go stale:
+        job_ids - the JOB_IDS of jobs, in order of priority
+        job_mask - bits of all jobs of the character
+        job_priority - position in jobs of every job id, -1 for jobs the character doesn't play"""
+        jobs = []
+        job_mask = 0
         for job in job_list:
-            if job in JOBS and job not in self.jobs:
-                self.jobs.append(job)
-            elif job in self.jobs:
+            job_id = JOB_IDS.get(job)
+            if job_id is not None and not job_mask & (1 << job_id):
+                jobs.append(job)
+                job_mask |= 1 << job_id
+            elif job_id is not None:
                 raise SyntaxError(f"{job} already registered")
-            elif job in CLASSES:
+            elif job in CLASS_SET:
                 raise SyntaxError(f"{job} is a class. Please be a responsible Warrior of Light and equip your "
                                   f"job/soul stone")
             else:
                 raise SyntaxError(f"{job} is not a valid job")
+        self.jobs = jobs
+        self.job_ids = tuple(JOB_IDS[job] for job in jobs)
+        self.job_mask = job_mask
+        self.job_priority = [-1] * len(JOBS)
+        for idx, job_id in enumerate(self.job_ids):
+            self.job_priority[job_id] = idx
 
     def get_overview_string(self):
         jobs_string = string_from_list(self.jobs)
@@ -79,97 +127,635 @@ def make_character_from_db(conn, discord_id, name):
         raise ValueError(f"No Character with id {discord_id} and name {name} found in db.")
 
 
+def make_characters_from_db(conn, discord_ids, names):
+    """(Character, num_raids, involuntary_benches) of every (discord_id, name) pair, in the given order,
+    loaded with a single query instead of one make_character_from_db each"""
+    rows = {(p[1], p[2]): p for p in get_players_by_ids(conn, discord_ids)}
+    characters = []
+    for discord_id, name in zip(discord_ids, names):
+        p = rows.get((discord_id, name))
+        if p is None:
+            raise ValueError(f"No Character with id {discord_id} and name {name} found in db.")
+        characters.append((Character(p[1], p[2], p[3], p[6]), p[5], p[6]))
+    return characters
+
+
+def roles_of(job_mask: int):
+    """Bits (1 << role number) of the roles the given jobs can fill"""
+    return sum(1 << role for role, role_mask in enumerate(ROLE_MASKS) if job_mask & role_mask)
+
+
+class RoleFeasibility:
+    """Tells whether a group can fill the roles at all, so that its job products don't need to be scored.
+    The members have to be matched to the role slots, which is possible iff every set of roles has at least as many
+    members that can play one of them as it has slots (Hall's condition, checked for all 7 sets of roles).
+    As roles are counted by distinct jobs, each role also needs as many distinct jobs among the members as slots.
+    Never rejects a group with a viable composition, but lets a few hopeless ones through."""
+    def __init__(self, n_tanks: int, n_healers: int, n_dps: int):
+        self.needed = (n_tanks, n_healers, n_dps)
+        self.slots = [(roles, sum(n for role, n in enumerate(self.needed) if roles >> role & 1))
+                      for roles in range(1, 8)]
+
+    def __call__(self, member_roles, group_mask: int):
+        """member_roles are the roles_of each member, group_mask the bits of all their jobs"""
+        for roles, slots in self.slots:
+            if slots and sum(1 for r in member_roles if r & roles) < slots:
+                return False
+        return all(popcount(group_mask & role_mask) >= n for role_mask, n in zip(ROLE_MASKS, self.needed))
+
+
+def composition_bonus(picked_jobs: tuple, no_double_jobs=True, maximize_diverse_dps=True):
+    """Score boosts/detractors that depend on the picked jobs as a whole, not on single members"""
+    return mask_bonus(jobs_mask(picked_jobs), len(picked_jobs), no_double_jobs, maximize_diverse_dps)
+
+
+def mask_bonus(picked_mask: int, n_picked: int, no_double_jobs=True, maximize_diverse_dps=True):
+    """composition_bonus of n_picked jobs whose bits are picked_mask"""
+    bonus = 0
+
+    # Do we have duplicates?
+    if no_double_jobs and popcount(picked_mask) != n_picked:
+        bonus -= 8  # Weight here might need to be adjusted
+
+    # Group DPS comp: +2 for at least two different types of DPS, +4 for one of each type (melee, ranged, caster)
+    if maximize_diverse_dps:
+        dps_types = (picked_mask & MELEE_MASK != 0) + (picked_mask & RANGED_MASK != 0) + (picked_mask & CASTER_MASK != 0)
+        bonus += DIVERSITY_BONUS[dps_types]
+
+    return bonus
+
+
+def member_job_score(member: Character, idx: int, use_benched_counter=True):
+    """Score of the job at position idx of member.jobs"""
+    member_score = len(JOBS) - idx  # First job in list gets highest priority and so on
+    if member.benched:  # member prefers to be on bench so we give him a lower priority
+        member_score -= 8  # need to tweak weight?
+    elif use_benched_counter:
+        member_score += member.involuntary_benches  # add times benched to score
+    return member_score
+
+
+def member_job_scores(member: Character, use_benched_counter=True):
+    """Score of each job of a member, in the order of member.jobs, as used by calc_composition_score"""
+    return [member_job_score(member, idx, use_benched_counter) for idx in range(len(member.jobs))]
+
+
+def scoring_profile(member: Character, use_benched_counter=True):
+    """Everything about a member that calc_composition_score looks at"""
+    benches = member.involuntary_benches if use_benched_counter and not member.benched else 0
+    return tuple(member.jobs), member.benched, benches
+
+
+def previous_twins(characters: list[Character], use_benched_counter=True):
+    """Index of the closest earlier character with the same scoring profile ("twin") for every character, -1 if
+    there is none. Returns None if nobody has a twin.
+    Twins are interchangeable, so a search only needs one composition of every class: the canonical one, in which
+    a character only joins after their previous twin and picks a later job of their list than that twin did.
+    A canonical group is thus just a number of members per class, filled with the earliest sign-ups."""
+    last_of_profile = {}
+    twins = []
+    for i, member in enumerate(characters):
+        profile = scoring_profile(member, use_benched_counter)
+        twins.append(last_of_profile.get(profile, -1))
+        last_of_profile[profile] = i
+    return twins if any(twin >= 0 for twin in twins) else None
+
+
+def twin_positions(group_idx: tuple, twins: list):
+    """Pairs of (position, position of the previous twin) in a group, or None if the group isn't canonical"""
+    position = {i: k for k, i in enumerate(group_idx)}
+    pairs = []
+    for k, i in enumerate(group_idx):
+        if twins[i] >= 0:
+            if twins[i] not in position:
+                return None
+            pairs.append((k, position[twins[i]]))
+    return pairs
+
+
 def calc_composition_score(combination: tuple[Character], picked_jobs: tuple, n_tanks: int, n_healers: int, n_dps: int,
                            no_double_jobs=True, maximize_diverse_dps=True, use_benched_counter=True):
+    picked_mask = jobs_mask(picked_jobs)
     # First checks - do we have the correct number of roles? if not, don't bother
-    if sum(t in picked_jobs for t in TANKS) != n_tanks:
+    # (roles are counted by distinct jobs)
+    if popcount(picked_mask & TANK_MASK) != n_tanks:
         score = 0
-    elif sum(h in picked_jobs for h in HEALERS) != n_healers:
+    elif popcount(picked_mask & HEALER_MASK) != n_healers:
         score = 0
-    elif sum(d in picked_jobs for d in DPS) != n_dps:
+    elif popcount(picked_mask & DPS_MASK) != n_dps:
         score = 0
     else:
         job_prios = []
         for i, member in enumerate(combination):
-            idx = member.jobs.index(picked_jobs[i])  # Combination and picked jobs must be in the correct order
-            member_score = len(JOBS) - idx  # First job in list gets highest priority and so on
-            if member.benched:  # member prefers to be on bench so we give him a lower priority
-                member_score -= 8  # need to tweak weight?
-            elif use_benched_counter:
-                member_score += member.involuntary_benches  # add times benched to score
-            job_prios.append(member_score)
+            # Combination and picked jobs must be in the correct order
+            idx = member.job_priority[JOB_IDS[picked_jobs[i]]]
+            job_prios.append(member_job_score(member, idx, use_benched_counter))
 
         score = sum(job_prios)
 
         # Extra score boosts/detractors
-
-        # Do we have duplicates?
-        if no_double_jobs and len(picked_jobs) != len(set(picked_jobs)):
-            score -= 8  # Weight here might need to be adjusted
-
-        # Group DPS comp
-        if maximize_diverse_dps:
-            if sum(d in picked_jobs for d in MELEES) > 0:
-                if sum(d in picked_jobs for d in RANGED) > 0:
-                    if sum(d in picked_jobs for d in CASTERS) > 0:
-                        # We have at least one of each type of DPS
-                        score += 4
-                    else:
-                        # We have at least two different types of DPS
-                        score += 2
-
-                elif sum(d in picked_jobs for d in CASTERS) > 0:
-                    # We have at least two different types of DPS
-                    score += 2
-            elif sum(d in picked_jobs for d in CASTERS) > 0 and sum(d in picked_jobs for d in RANGED) > 0:
-                # We have at least two different types of DPS
-                score += 2
+        score += mask_bonus(picked_mask, len(picked_jobs), no_double_jobs, maximize_diverse_dps)
 
         # TODO: add number of participated raids into calculation
 
     return score
 
 
-def make_raid(characters: list[Character], n_tanks: int, n_healers: int, n_dps: int,
-              no_double_jobs=True, maximize_diverse_dps=True, use_benched_counter=True):
-    """Given a list of Characters, this will form the most desirable possible raid composition"""
-    n_raiders = n_tanks + n_healers + n_dps
+class SearchCancelled(Exception):
+    """Raised inside make_raid when its SearchToken was cancelled or its time budget ran out"""
+
+
+class SearchToken:
+    """Lets another thread follow and stop a running make_raid call.
+    progress is the fraction of the search space that has been covered so far (0 to 1).
+    The search stops with SearchCancelled once cancel() was called or time_budget seconds have passed.
+    pruned_groups and pruned_products count what was skipped because it can't fill the roles: whole groups and their
+    job products in the exhaustive search, dropped branches and the jobs not tried in branch and bound."""
+    def __init__(self, time_budget=None):
+        self.progress = 0.0
+        self.pruned_groups = 0
+        self.pruned_products = 0
+        self.cancelled = False
+        self.timed_out = False
+        self.deadline = time.monotonic() + time_budget if time_budget else None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def advance(self, fraction):
+        self.progress = min(1.0, self.progress + fraction)
+
+    def count_pruned(self, n_products, n_groups=1):
+        self.pruned_groups += n_groups
+        self.pruned_products += n_products
+
+    def check(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.timed_out = True
+            self.cancelled = True
+        if self.cancelled:
+            raise SearchCancelled("Raid search ran out of time" if self.timed_out else "Raid search was cancelled")
+
+
+class _ChunkToken(SearchToken):
+    """Token of a search chunk in a worker process. Stops the chunk at the deadline of the calling process's token
+    (time.monotonic() is system-wide) or once the shared cancel event is set. Asking for the event takes a round trip
+    to its manager process, so that is only done every poll_interval seconds."""
+    def __init__(self, deadline=None, cancel=None, poll_interval=0.2):
+        super().__init__()
+        self.deadline = deadline
+        self._cancel = cancel
+        self._poll_interval = poll_interval
+        self._next_poll = 0.0
+
+    def check(self):
+        if self._cancel is not None and time.monotonic() >= self._next_poll:
+            self._next_poll = time.monotonic() + self._poll_interval
+            if self._cancel.is_set():
+                self.cancelled = True
+        super().check()
+
+
+def prefix_size(n_characters: int, n_raiders: int, prefix: tuple):
+    """Number of groups whose lowest members are exactly prefix, a tuple of increasing indices"""
+    if not prefix:
+        return math.comb(n_characters, n_raiders)
+    return math.comb(n_characters - 1 - prefix[-1], n_raiders - len(prefix))
+
+
+def prefix_shares(n_characters: int, n_raiders: int, prefixes):
+    """Share of the groups of prefixes that start with each of them, summing up to 1"""
+    counts = {prefix: prefix_size(n_characters, n_raiders, prefix) for prefix in prefixes}
+    total = sum(counts.values())
+    return {prefix: count / total if total else 0 for prefix, count in counts.items()}
+
+
+def split_search(n_characters: int, n_raiders: int, n_chunks: int):
+    """Splits all groups into at most n_chunks lists of prefixes (see prefix_size) with about as many groups each.
+    Prefixes with more than a chunk's share of groups are replaced by their one member longer prefixes first, as the
+    groups starting with the first characters alone are a large part of the search."""
+    target = math.comb(n_characters, n_raiders) / n_chunks
+    prefixes = []
+    todo = [()]
+    while todo:
+        prefix = todo.pop()
+        size = prefix_size(n_characters, n_raiders, prefix)
+        if size == 0:
+            continue
+        if size <= target or len(prefix) == n_raiders:
+            prefixes.append((size, prefix))
+        else:
+            start = prefix[-1] + 1 if prefix else 0
+            todo.extend((*prefix, i) for i in range(start, n_characters - n_raiders + len(prefix) + 1))
+
+    # Biggest prefixes first, each into the chunk with the fewest groups so far
+    chunks = [(0, c, []) for c in range(n_chunks)]
+    for size, prefix in sorted(prefixes, reverse=True):
+        n_groups, c, chunk = heapq.heappop(chunks)
+        chunk.append(prefix)
+        heapq.heappush(chunks, (n_groups + size, c, chunk))
+    return [sorted(chunk) for _, _, chunk in sorted(chunks, key=lambda x: x[1]) if chunk]
+
+
+class _LastFirst:
+    """Wraps a composition key so that later keys sort first, letting a min-heap drop the latest of equal scores"""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+class CompositionCollector:
+    """Collects scored compositions from a search without storing every viable one.
+    With top_k=None it keeps all compositions tied at the best score, otherwise the top_k best ones
+    (on equal scores the ones the exhaustive search would list first win).
+    Compositions are keys of (group indices, job indices) into the searched character list."""
+    def __init__(self, top_k=None):
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        self.top_k = top_k
+        self.best_score = 0
+        self._ties = []
+        self._heap = []
+
+    @property
+    def threshold(self):
+        """Lowest score a composition needs to still be collected"""
+        if self.top_k is None:
+            return max(self.best_score, 1)
+        if len(self._heap) < self.top_k:
+            return 1
+        return self._heap[0][0]
+
+    def add(self, key, score):
+        if score < self.threshold:
+            return
+        if self.top_k is None:
+            if score > self.best_score:
+                self.best_score = score
+                self._ties = []
+            self._ties.append(key)
+        else:
+            heapq.heappush(self._heap, (score, _LastFirst(key)))
+            if len(self._heap) > self.top_k:
+                heapq.heappop(self._heap)
+            self.best_score = max(self.best_score, score)
+
+    def consume(self, candidates):
+        for key, score in candidates:
+            self.add(key, score)
+        return self
+
+    def results(self):
+        """List of (key, score), best first and otherwise in the order the exhaustive search enumerates"""
+        if self.top_k is None:
+            return [(key, self.best_score) for key in sorted(self._ties)]
+        return sorted(((entry.key, score) for score, entry in self._heap), key=lambda x: (-x[1], x[0]))
+
+
+def combinations_by_prefix(n_characters: int, n_raiders: int, prefixes=None):
+    """Same as itertools.combinations(range(n_characters), n_raiders), optionally restricted to the groups whose
+    lowest members are one of prefixes. Used to split a search into independent chunks."""
+    if prefixes is None:
+        yield from itertools.combinations(range(n_characters), n_raiders)
+        return
+    for prefix in prefixes:
+        start = prefix[-1] + 1 if prefix else 0
+        for rest in itertools.combinations(range(start, n_characters), n_raiders - len(prefix)):
+            yield (*prefix, *rest)
+
+
+def group_progress_share(n_characters: int, n_raiders: int, prefixes=None):
+    """Progress made by every single group of combinations_by_prefix"""
+    if prefixes is None:
+        n_groups = math.comb(n_characters, n_raiders)
+    else:
+        n_groups = sum(prefix_size(n_characters, n_raiders, prefix) for prefix in prefixes)
+    return 1 / n_groups if n_groups else 0
 
-    # If not enough raiders are given, we might as well stop here
-    if len(characters) < n_raiders:
-        print("Not enough participants")
-        return None
 
-    groups_comps_and_scores = []
+def exhaustive_candidates(characters: list[Character], n_tanks: int, n_healers: int, n_dps: int,
+                          no_double_jobs=True, maximize_diverse_dps=True, use_benched_counter=True, collector=None,
+                          prefixes=None, token=None, twins=None):
+    """Scores every job product of every possible group and yields the viable ones.
+    Slow, but simple enough to cross-check other solvers. Groups that can't fill the roles are skipped, and with
+    twins (see previous_twins) only canonical compositions are scored."""
+    n_raiders = n_tanks + n_healers + n_dps
+    group_share = group_progress_share(len(characters), n_raiders, prefixes)
+    feasible = RoleFeasibility(n_tanks, n_healers, n_dps)
+    member_roles = [roles_of(member.job_mask) for member in characters]
+
     # Iterate through all possible combinations of the given number of players
-    for group in itertools.combinations(characters, n_raiders):
-        # Get all jobs for each member of this combination in one list of lists
-        job_lists = []
+    for group_idx in combinations_by_prefix(len(characters), n_raiders, prefixes):
+        if token:
+            token.check()
+            token.advance(group_share)
+        if twins:
+            pairs = twin_positions(group_idx, twins)
+            if pairs is None:
+                continue
+        group = tuple(characters[i] for i in group_idx)
+        group_mask = 0
         for member in group:
-            job_lists.append(member.jobs)
+            group_mask |= member.job_mask
+        if not feasible([member_roles[i] for i in group_idx], group_mask):
+            if token:
+                token.count_pruned(math.prod(len(member.jobs) for member in group))
+            continue
 
         # Get all possible job combinations
-        comps = itertools.product(*job_lists)
-
-        # Iterate over comps and get scores
-        for comp in comps:
+        for comp_idx in itertools.product(*[range(len(member.jobs)) for member in group]):
+            if twins and any(comp_idx[k] <= comp_idx[p] for k, p in pairs):
+                continue
+            comp = tuple(member.jobs[j] for member, j in zip(group, comp_idx))
             score = calc_composition_score(group, comp, n_tanks, n_healers, n_dps,
                                            no_double_jobs, maximize_diverse_dps, use_benched_counter)
-            if score > 0:  # only append viable combinations
-                groups_comps_and_scores.append([group, comp, score])
+            if score > 0:  # only yield viable combinations
+                yield (group_idx, comp_idx), score
+
+
+def branch_and_bound_candidates(characters: list[Character], n_tanks: int, n_healers: int, n_dps: int,
+                                no_double_jobs=True, maximize_diverse_dps=True, use_benched_counter=True,
+                                collector=None, prefixes=None, token=None, twins=None):
+    """Yields the same best compositions as exhaustive_candidates, but decides player by player whether (and on which
+    job) they join the group, and drops every branch that can no longer fill the roles or reach the collector's
+    threshold, or that isn't canonical with respect to twins.
+    Every branch carries the share of the search space it covers, which is added to the token's progress
+    once the branch is done."""
+    n_raiders = n_tanks + n_healers + n_dps
+    n_chars = len(characters)
+    if collector is None:
+        collector = CompositionCollector()
+
+    job_scores = [member_job_scores(member, use_benched_counter) for member in characters]
+    job_roles = [[ROLE_OF_JOB[job] for job in member.jobs] for member in characters]
+    job_bits = [[1 << job_id for job_id in member.job_ids] for member in characters]
+    max_bonus = 4 if maximize_diverse_dps else 0
+
+    needed = [n_tanks, n_healers, n_dps]  # open slots per role
+    group = []  # indices of picked characters
+    comp = []  # indices into the picked characters' job lists
+    picked = [0]  # bits of the picked jobs
+    job_of = [-1] * n_chars  # index into the job list of every picked character
+    prefix = [()]  # characters up to prefix[0][-1] join if they are in it and are left out otherwise
+
+    def upper_bound(start, slots):
+        """Best score the remaining characters could still add, or None if they can't fill the open roles"""
+        best_per_member = []
+        role_capacity = [0, 0, 0]
+        for i in range(start, n_chars):
+            usable = [(score, role) for bit, score, role in zip(job_bits[i], job_scores[i], job_roles[i])
+                      if needed[role] > 0 and not bit & picked[0]]
+            if usable:
+                best_per_member.append(max(score for score, _ in usable))
+                for role in set(role for _, role in usable):
+                    role_capacity[role] += 1
+        if len(best_per_member) < slots or any(cap < need for cap, need in zip(role_capacity, needed)):
+            return None
+        best_per_member.sort(reverse=True)
+        return sum(best_per_member[:slots])
+
+    def reachable(start, partial_score):
+        """Whether characters from `start` on can still complete the group with a score worth collecting"""
+        slots = n_raiders - len(group)
+        if n_chars - start < slots:
+            return False
+        remaining = upper_bound(start, slots)
+        if remaining is None:
+            return False
+        # Can't reach a score that would still be collected
+        return partial_score + remaining + max_bonus >= collector.threshold
+
+    def done(share):
+        if token:
+            token.advance(share)
+
+    def search(start, partial_score, share):
+        if len(group) == n_raiders:
+            score = partial_score + mask_bonus(picked[0], n_raiders, no_double_jobs, maximize_diverse_dps)
+            if score > 0:
+                yield (tuple(group), tuple(comp)), score
+            done(share)
+            return
+        if token:
+            token.check()
+        if not reachable(start, partial_score):
+            if token:
+                token.count_pruned(0)
+            done(share)
+            return
+        if prefix[0] and start <= prefix[0][-1]:
+            if start in prefix[0]:
+                yield from take(start, partial_score, share)
+            else:
+                yield from search(start + 1, partial_score, share)
+            return
+        # Of the groups below this branch, slots out of n_left contain character `start`
+        slots = n_raiders - len(group)
+        n_left = n_chars - start
+        # Take character `start` with each of their jobs ...
+        yield from take(start, partial_score, share * slots / n_left)
+        # ... or leave them out
+        yield from search(start + 1, partial_score, share * (n_left - slots) / n_left)
+
+    def take(i, partial_score, share):
+        twin = twins[i] if twins else -1
+        # Twins join in order, so a character whose previous twin was left out stays out as well
+        if not job_roles[i] or (twin >= 0 and job_of[twin] < 0):
+            done(share)
+            return
+        job_share = share / len(job_roles[i])
+        for j, role in enumerate(job_roles[i]):
+            # calc_composition_score counts roles by distinct jobs, so a doubled job can never fill its roles
+            role_full = needed[role] == 0 or job_bits[i][j] & picked[0]
+            if role_full or (twin >= 0 and j <= job_of[twin]):
+                if token and role_full:
+                    token.count_pruned(1, 0)
+                done(job_share)
+                continue
+            needed[role] -= 1
+            group.append(i)
+            comp.append(j)
+            picked[0] |= job_bits[i][j]
+            job_of[i] = j
+            yield from search(i + 1, partial_score + job_scores[i][j], job_share)
+            job_of[i] = -1
+            picked[0] &= ~job_bits[i][j]
+            comp.pop()
+            group.pop()
+            needed[role] += 1
+
+    if prefixes is None:
+        yield from search(0, 0, 1)
+    else:
+        for chunk_prefix, share in prefix_shares(n_chars, n_raiders, prefixes).items():
+            prefix[0] = chunk_prefix
+            yield from search(0, 0, share)
+
+
+SOLVERS = {
+    "branch_and_bound": branch_and_bound_candidates,
+    "exhaustive": exhaustive_candidates,
+}
 
-    # We find the best comp by looking for the max score
-    best = max(groups_comps_and_scores, key=lambda x: x[2])
+BACKENDS = ["python", "numpy"]
 
-    # Get list of best raids if there are multiple
-    best_score = best[2]
-    all_bests = [raid for raid in groups_comps_and_scores if raid[2] == best_score]
+
+def _candidate_source(solver, backend):
+    if solver == "exhaustive" and backend == "numpy":
+        from raidbot.numpy_scoring import exhaustive_candidates
+        return exhaustive_candidates
+    return SOLVERS[solver]
+
+
+def _search_chunk(prefixes, characters, n_tanks, n_healers, n_dps, settings, solver, backend, top_k, twins,
+                  deadline=None, cancel=None):
+    """Searches the groups starting with one of prefixes and returns the locally collected (key, score) pairs,
+    along with the numbers of pruned groups and products.
+    Runs in a worker process when make_raid is called with workers > 1, and raises SearchCancelled after the deadline
+    or once cancel is set."""
+    collector = CompositionCollector(top_k)
+    token = _ChunkToken(deadline, cancel)
+    candidates = _candidate_source(solver, backend)
+    collector.consume(candidates(characters, n_tanks, n_healers, n_dps, *settings, collector,
+                                 prefixes=prefixes, token=token, twins=twins))
+    return collector.results(), token.pruned_groups, token.pruned_products
+
+
+_pool_lock = threading.Lock()
+_pool = None
+_pool_workers = 0
+_manager = None
+
+
+def _start_method():
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _cancel_event():
+    """Event that can be handed to the chunks of a search to stop them"""
+    global _manager
+    with _pool_lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context(_start_method()).Manager()
+        return _manager.Event()
+
+
+def _worker_pool(workers):
+    """Process pool shared by all parallel searches, so its processes are only started once (or again when the number
+    of workers changes). They are started by a fork server where there is one, instead of being forked from the
+    calling process, which in the bot runs plenty of threads."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(_start_method()))
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parallel_search(collector, workers, characters, n_tanks, n_healers, n_dps, settings, solver, backend, top_k,
+                     token=None, twins=None):
+    n_raiders = n_tanks + n_healers + n_dps
+    n_groups = math.comb(len(characters), n_raiders)
+    pool = _worker_pool(workers)
+    # Only a search with a token can be stopped
+    cancel = _cancel_event() if token else None
+    deadline = token.deadline if token else None
+    chunks = {}
+    try:
+        # A few chunks per worker, so that workers done early can take over the rest
+        for prefixes in split_search(len(characters), n_raiders, 4 * workers):
+            chunk = pool.submit(_search_chunk, prefixes, characters, n_tanks, n_healers, n_dps, settings,
+                                solver, backend, top_k, twins, deadline, cancel)
+            chunks[chunk] = sum(prefix_size(len(characters), n_raiders, prefix) for prefix in prefixes) / n_groups
+        pending = set(chunks)
+        while pending:
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for chunk in finished:
+                try:
+                    results, pruned_groups, pruned_products = chunk.result()
+                except SearchCancelled:
+                    if token:
+                        token.check()  # the chunk ran out of time, so did the token
+                    raise
+                collector.consume(results)
+                if token:
+                    token.advance(chunks[chunk])
+                    token.count_pruned(pruned_products, pruned_groups)
+            if token:
+                token.check()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        # Stops the chunks that are still running after a cancellation, and drops the ones that did not start
+        if cancel is not None:
+            cancel.set()
+        for chunk in chunks:
+            chunk.cancel()
+
+
+def make_raid(characters: list[Character], n_tanks: int, n_healers: int, n_dps: int,
+              no_double_jobs=True, maximize_diverse_dps=True, use_benched_counter=True, solver="branch_and_bound",
+              top_k=None, backend="python", workers=1, token: SearchToken = None, merge_twins=True):
+    """Given a list of Characters, this will form the most desirable possible raid composition.
+    solver can be "branch_and_bound" (default) or "exhaustive", which tries every composition and is kept for
+    cross-checking. Both return the same list of [group, comp, score] entries: all compositions tied at the best
+    score, or the top_k best compositions (best first) if top_k is given.
+    backend selects how the exhaustive solver scores compositions: "python" or "numpy" (needs numpy installed), other
+    solvers only support "python".
+    With workers > 1 the search is split into chunks of about equal size by the lowest members of each group, and run
+    in that many processes.
+    A SearchToken reports the progress of the search and can stop it, in which case SearchCancelled is raised.
+    With merge_twins, players with the same jobs and bench situation are treated as one class, and of the
+    compositions that only swap such players around just the one using the earliest sign-ups is returned."""
+    n_raiders = n_tanks + n_healers + n_dps
+
+    # If not enough raiders are given, we might as well stop here
+    if len(characters) < n_raiders:
+        print("Not enough participants")
+        return None
+
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver}, use one of {', '.join(SOLVERS)}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, use one of {', '.join(BACKENDS)}")
+    if backend != "python" and solver != "exhaustive":
+        raise ValueError(f"The {backend} backend only works with the exhaustive solver")
+
+    settings = (no_double_jobs, maximize_diverse_dps, use_benched_counter)
+    twins = previous_twins(characters, use_benched_counter) if merge_twins else None
+    collector = CompositionCollector(top_k)
+    if workers > 1 and n_raiders > 0:
+        # Every group starts with exactly one of the prefixes, so the chunks don't overlap and their bests can just be
+        # merged
+        _parallel_search(collector, workers, characters, n_tanks, n_healers, n_dps, settings, solver, backend, top_k,
+                         token, twins)
+    else:
+        candidates = _candidate_source(solver, backend)
+        collector.consume(candidates(characters, n_tanks, n_healers, n_dps, *settings, collector, token=token,
+                                     twins=twins))
 
     # Statistics, out of curiosity, comment out later:
-    # stat_str = f"There are {len(groups_comps_and_scores)} viable combinations.\n" \
-    #            f"Best score of {best_score} appears {len(all_bests)} times."
+    # stat_str = f"Best score of {collector.best_score} appears {len(collector.results())} times."
 
-    return all_bests  # , stat_str
+    return [[tuple(characters[i] for i in group_idx),
+             tuple(characters[i].jobs[j] for i, j in zip(group_idx, comp_idx)),
+             score]
+            for (group_idx, comp_idx), score in collector.results()]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,36 @@
+import asyncio
+import traceback
+
+
+class RenderQueue:
+    """Coalesces edits of the same message.
+    The first schedule() for a key opens a window of `delay` seconds. Renders scheduled for that key in the meantime
+    replace each other, and once the window is over only the latest one runs."""
+    def __init__(self, delay=1.5):
+        self.delay = delay
+        self._pending = {}  # key -> latest render, a coroutine function
+        self._windows = {}  # key -> task waiting for the window to end
+
+    def schedule(self, key, render):
+        self._pending[key] = render
+        if key not in self._windows:
+            self._windows[key] = asyncio.ensure_future(self._run(key))
+
+    def discard(self, key):
+        """Drops a pending render, e.g. because the message is about to be edited another way"""
+        self._pending.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    async def _run(self, key):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            del self._windows[key]
+        render = self._pending.pop(key, None)
+        if render is not None:
+            try:
+                await render()
+            except Exception as e:
+                print(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
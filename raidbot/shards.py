@@ -0,0 +1,137 @@
+"""Running the bot as several processes, one per discord shard.
+Discord sends each shard the events of the guilds with (guild_id >> 22) % shard_count == shard_id, so every process
+owns a disjoint set of guilds and with them their ./database/<guild_id>.db files. A ShardSupervisor starts the
+processes, restarts them when they crash and reports the status every shard writes to ./shards/<shard_id>.json."""
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+STATUS_DIR = "./shards/"
+
+
+def shard_of(guild_id: int, shard_count: int):
+    """The shard discord sends the events of a guild to"""
+    return (guild_id >> 22) % shard_count
+
+
+def shard_settings():
+    """(shard_id, shard_count) of this process from the SHARD_ID and SHARD_COUNT environment variables,
+    or (None, None) if it is not one of several shards"""
+    try:
+        shard_id, shard_count = int(os.environ["SHARD_ID"]), int(os.environ["SHARD_COUNT"])
+    except (KeyError, ValueError):
+        return None, None
+    return shard_id, shard_count
+
+
+def write_status(shard_id, status: dict, status_dir=STATUS_DIR):
+    """Saves the status of a shard for its supervisor, replacing the file at once so it is never read half-written"""
+    Path(status_dir).mkdir(parents=True, exist_ok=True)
+    path = Path(status_dir) / f"{shard_id}.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({**status, "time": time.time()}))
+    os.replace(tmp, path)
+
+
+def read_status(shard_id, status_dir=STATUS_DIR):
+    try:
+        return json.loads((Path(status_dir) / f"{shard_id}.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+class Shard:
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.restarts = 0
+        self.started = 0.0  # time.monotonic() of the last start
+        self.next_start = 0.0  # time.monotonic() at which it may be (re)started
+
+
+class ShardSupervisor:
+    """Keeps one process per shard running.
+    A shard that exits is started again, after restart_delay seconds that double with every crash in a row (up to
+    max_restart_delay), so a shard that can't start does not spin. command is the program every shard runs, with
+    SHARD_ID and SHARD_COUNT set in its environment.
+    The first starts are identify_delay seconds apart: each shard identifies with the gateway when it starts, and
+    discord only accepts one identify at a time, which discord.py can't pace across processes."""
+    def __init__(self, shard_count, command=None, status_dir=STATUS_DIR, restart_delay=5.0, max_restart_delay=300.0,
+                 stable_after=600.0, identify_delay=5.0):
+        self.shard_count = shard_count
+        self.command = command or [sys.executable, os.path.abspath(sys.argv[0])]
+        self.status_dir = status_dir
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after  # a shard running this long has its crash count reset
+        self.shards = [Shard(i) for i in range(shard_count)]
+        now = time.monotonic()
+        for shard in self.shards:
+            shard.next_start = now + shard.shard_id * identify_delay
+
+    def _start(self, shard):
+        env = {**os.environ, "SHARD_ID": str(shard.shard_id), "SHARD_COUNT": str(self.shard_count)}
+        shard.process = subprocess.Popen(self.command, env=env)
+        shard.started = time.monotonic()
+
+    def step(self):
+        """Starts shards that are not running (anymore) and are due, returns the ids of the ones that crashed"""
+        crashed = []
+        now = time.monotonic()
+        for shard in self.shards:
+            if shard.process is not None and shard.process.poll() is not None:
+                code = shard.process.returncode
+                print(f"Shard {shard.shard_id} exited with code {code}")
+                crashed.append(shard.shard_id)
+                if now - shard.started > self.stable_after:
+                    shard.restarts = 0
+                delay = min(self.restart_delay * 2 ** shard.restarts, self.max_restart_delay)
+                shard.restarts += 1
+                shard.next_start = now + delay
+                shard.process = None
+            if shard.process is None and now >= shard.next_start:
+                self._start(shard)
+        return crashed
+
+    def report(self):
+        """One line per shard with its process state and the load it reported last"""
+        lines = []
+        for shard in self.shards:
+            running = shard.process is not None and shard.process.poll() is None
+            line = f"shard {shard.shard_id}: {'running' if running else 'down'}, {shard.restarts} restarts"
+            status = read_status(shard.shard_id, self.status_dir)
+            if status:
+                line += (f", {status.get('guilds', 0)} guilds, {status.get('reactions', 0)} reactions and "
+                         f"{status.get('commands', 0)} commands, latency {status.get('latency', 0) * 1000:.0f} ms, "
+                         f"reported {time.time() - status['time']:.0f} s ago")
+            lines.append(line)
+        return lines
+
+    def run(self, poll_interval=1.0, report_interval=60.0):
+        """Supervises until interrupted, then stops all shards"""
+        last_report = time.monotonic()
+        try:
+            while True:
+                self.step()
+                if time.monotonic() - last_report >= report_interval:
+                    print("\n".join(self.report()))
+                    last_report = time.monotonic()
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10.0):
+        for shard in self.shards:
+            if shard.process is not None and shard.process.poll() is None:
+                shard.process.terminate()
+        for shard in self.shards:
+            if shard.process is not None:
+                try:
+                    shard.process.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    shard.process.kill()
@@ -0,0 +1,80 @@
+import asyncio
+import sqlite3
+import unittest
+
+from raidbot.character_cache import CharacterCache
+from raidbot.database import initialize_db_with_tables, create_player, update_player
+
+
+class FakeDatabase:
+    """Runs functions on a plain connection, like AsyncDatabase.run does on its thread"""
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        initialize_db_with_tables(self.conn)
+        self.calls = 0
+
+    async def run(self, fn, *args):
+        self.calls += 1
+        return fn(self.conn, *args)
+
+
+class CharacterCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase()
+        create_player(self.db.conn, (42, "Nama Zu", "PLD,DNC", "2021-05-01", 3, 1))
+        create_player(self.db.conn, (43, "Na Mazu", "WHM", "2021-05-01", 0, 0))
+
+    def tearDown(self):
+        self.db.conn.close()
+
+    def test_hits_and_copies(self):
+        cache = CharacterCache()
+
+        async def scenario():
+            chara, date, num_raids = await cache.get(self.db, 1, 42)
+            chara.jobs.insert(0, "SAM")  # like add-job before validating
+            again, _, _ = await cache.get(self.db, 1, 42)
+            named, _, _ = await cache.get(self.db, 1, 42, "Nama Zu")
+            return chara, again, named, num_raids
+
+        chara, again, named, num_raids = asyncio.run(scenario())
+        self.assertEqual(3, num_raids)
+        self.assertEqual(["PLD", "DNC"], again.jobs)
+        self.assertIsNot(chara, again)
+        self.assertEqual("Nama Zu", named.character_name)
+        self.assertEqual((2, 1, 1), (cache.hits, cache.misses, self.db.calls))
+
+    def test_invalidate(self):
+        cache = CharacterCache()
+
+        async def scenario():
+            await cache.get(self.db, 1, 42)
+            update_player(self.db.conn, "jobs", "SAM", 42, "Nama Zu")
+            cache.invalidate(1, 42)
+            chara, _, _ = await cache.get(self.db, 1, 42)
+            await cache.get(self.db, 2, 42)  # other guilds have their own entries
+            return chara
+
+        self.assertEqual(["SAM"], asyncio.run(scenario()).jobs)
+        self.assertEqual((0, 3), (cache.hits, cache.misses))
+
+    def test_evicts_least_recently_used(self):
+        cache = CharacterCache(max_size=1)
+
+        async def scenario():
+            await cache.get(self.db, 1, 42)
+            await cache.get(self.db, 1, 43)
+            await cache.get(self.db, 1, 42)
+
+        asyncio.run(scenario())
+        self.assertEqual((0, 3, 1), (cache.hits, cache.misses, len(cache)))
+
+    def test_unknown_player(self):
+        cache = CharacterCache()
+        with self.assertRaises(IndexError):
+            asyncio.run(cache.get(self.db, 1, 99))
+        self.assertEqual(0, len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,19 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+from raidbot import database
+from raidbot.async_database import AsyncDatabase
+from raidbot.database import ConnectionPool, initialize_db_with_tables, get_event_by_message, create_event, \
+    set_event_message, transaction, update_event_fields, update_player_fields, create_player, get_player, get_event, \
+    create_connection, add_participant, remove_participant, set_participant_bench, set_event_roster, \
+    get_event_participants, get_events_of_player, increment_player_counter, create_table_sql_command, \
+    migrate_event_participants, get_schema_version, migrate, EVENT_COLUMNS, EVENT_COLUMNS_TYPES, SCHEMA_VERSION
+from raidbot.event import make_event_from_db
 
 
 class MyTestCase(unittest.TestCase):
@@ -6,5 +21,329 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(True, False)
 
 
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.pool = ConnectionPool(self.open_connection, max_open=2)
+
+    def open_connection(self, key):
+        self.opened.append(key)
+        return sqlite3.connect(":memory:")
+
+    def test_reuses_connection(self):
+        first = self.pool.get(1)
+        first.execute("CREATE TABLE t (x integer)")
+        first.close()
+        second = self.pool.get(1)
+        self.assertEqual([], second.execute("SELECT * FROM t").fetchall())
+        second.close()
+        self.assertEqual([1], self.opened)
+
+    def test_evicts_least_recently_used_idle_connection(self):
+        for key in (1, 2):
+            self.pool.get(key).close()
+        self.pool.get(1).close()
+        self.pool.get(3).close()
+        self.assertEqual(2, len(self.pool))
+        self.pool.get(2).close()
+        self.assertEqual([1, 2, 3, 2], self.opened)
+
+    def test_keeps_connections_in_use(self):
+        in_use = [self.pool.get(key) for key in (1, 2, 3)]
+        self.assertEqual(3, len(self.pool))
+        for conn in in_use:
+            conn.execute("SELECT 1")
+            conn.close()
+        self.assertEqual(2, len(self.pool))
+
+    def test_close_is_idempotent(self):
+        conn = self.pool.get(1)
+        conn.close()
+        conn.close()
+        other = self.pool.get(1)
+        self.pool.get(2).close()
+        self.pool.get(3).close()
+        other.execute("SELECT 1")  # still open, its guild was not evicted
+        other.close()
+
+
+class EventMessageIdTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_migration_backfills_message_ids(self):
+        # events table as created before the id columns existed
+        self.conn.execute("CREATE TABLE events (id integer PRIMARY KEY, name text NOT NULL, timestamp integer NOT NULL, "
+                          "participant_names text, participant_ids text, is_bench text, jobs text, role_numbers text, "
+                          "creator_id integer NOT NULL, message_link text, state text NOT NULL)")
+        self.conn.execute("INSERT INTO events (name, timestamp, role_numbers, creator_id, message_link, state) "
+                          "VALUES ('Raid', 0, '2,2,4', 1, 'https://discord.com/channels/11/22/33', 'RECRUITING')")
+        self.conn.execute("INSERT INTO events (name, timestamp, role_numbers, creator_id, message_link, state) "
+                          "VALUES ('Unposted', 0, '2,2,4', 1, NULL, 'RECRUITING')")
+        initialize_db_with_tables(self.conn)
+
+        rows = get_event_by_message(self.conn, 33)
+        self.assertEqual(1, len(rows))
+        self.assertEqual(("Raid", 11, 22, 33), (rows[0][1], *rows[0][-3:]))
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT * FROM events WHERE message_id=33").fetchall()
+        self.assertIn("events_message_id", str(plan))
+
+    def test_set_event_message(self):
+        initialize_db_with_tables(self.conn)
+        ev_id = create_event(self.conn, ("Raid", 0, None, None, None, None, "2,2,4", 1, None, "RECRUITING",
+                                         None, None, None))
+        set_event_message(self.conn, ev_id, "https://discord.com/channels/11/22/44")
+        self.assertEqual(ev_id, get_event_by_message(self.conn, 44)[0][0])
+
+
+class IndexTestCase(unittest.TestCase):
+    def test_lookups_use_indexes(self):
+        conn = sqlite3.connect(":memory:")
+        # tables of an existing database made before the indexes
+        conn.execute("CREATE TABLE players (id integer PRIMARY KEY, discord_id integer NOT NULL, "
+                     "character_name text NOT NULL, jobs text, signup_date text, num_raids integer, "
+                     "involuntary_benches integer)")
+        conn.execute("CREATE TABLE server_info (id integer PRIMARY KEY, key text, value text)")
+        initialize_db_with_tables(conn)
+        for query, index in [("SELECT * FROM players WHERE discord_id=1", "players_discord_id"),
+                             ("SELECT * FROM players WHERE discord_id=1 AND character_name='A'", "players_discord_id"),
+                             ("SELECT * FROM players WHERE character_name='A'", "players_character_name"),
+                             ("SELECT * FROM server_info WHERE key='event_channel'", "server_info_key"),
+                             ("SELECT * FROM events WHERE state='RECRUITING'", "events_state")]:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+            self.assertIn(index, str(plan), query)
+        conn.close()
+
+
+class EventParticipantsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        initialize_db_with_tables(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def new_event(self, roster=(None, None, None, None)):
+        return create_event(self.conn, ("Raid", 0, *roster, "2,2,4", 1, None, "RECRUITING", None, None, None))
+
+    def test_migration_moves_rosters(self):
+        self.conn.close()
+        self.conn = sqlite3.connect(":memory:")
+        # a database from before event_participants
+        self.conn.execute(create_table_sql_command("events", EVENT_COLUMNS, EVENT_COLUMNS_TYPES))
+        ev_id = self.new_event(("A,B,C", "1,2,3", "0,1,0", "PLD,None,WHM"))
+        open_id = self.new_event(("A", "1", "0", None))
+        initialize_db_with_tables(self.conn)
+        migrate_event_participants(self.conn)  # moving twice does not duplicate rows
+
+        self.assertEqual([(1, "A", 0, "PLD"), (2, "B", 1, None), (3, "C", 0, "WHM")],
+                         get_event_participants(self.conn, ev_id))
+        self.assertEqual((None, None, None, None), get_event(self.conn, ev_id)[0][3:7])
+        event = make_event_from_db(self.conn, open_id)
+        self.assertEqual(([1], ["A"], [0], []), (event.participant_ids, event.participant_names, event.is_bench,
+                                                 event.jobs))
+        self.assertEqual({ev_id, open_id}, {row[0] for row in get_events_of_player(self.conn, 1)})
+
+    def test_single_row_changes(self):
+        ev_id = self.new_event()
+        add_participant(self.conn, ev_id, 1, "A", 0)
+        add_participant(self.conn, ev_id, 2, "B", 1)
+        add_participant(self.conn, ev_id, 3, "C", 0)
+        remove_participant(self.conn, ev_id, 1)
+        set_participant_bench(self.conn, ev_id, 2, 0)
+        add_participant(self.conn, ev_id, 1, "A", 1)
+
+        event = make_event_from_db(self.conn, ev_id)
+        self.assertEqual([2, 3, 1], event.participant_ids)
+        self.assertEqual(["B", "C", "A"], event.participant_names)
+        self.assertEqual([0, 0, 1], event.is_bench)
+
+    def test_set_event_roster(self):
+        ev_id = self.new_event()
+        add_participant(self.conn, ev_id, 1, "A", 0)
+        add_participant(self.conn, ev_id, 2, "B", 0)
+        set_event_roster(self.conn, ev_id, [2, 1], ["B", "A"], [0, 1], ["WHM", None])
+        event = make_event_from_db(self.conn, ev_id)
+        self.assertEqual(([2, 1], [0, 1], ["WHM", None]), (event.participant_ids, event.is_bench, event.jobs))
+
+
+class MigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_versions(self):
+        self.conn.execute("CREATE TABLE server_info (id integer PRIMARY KEY, key text, value text)")
+        self.assertEqual(0, get_schema_version(self.conn))
+        initialize_db_with_tables(self.conn)
+        self.assertEqual(SCHEMA_VERSION, get_schema_version(self.conn))
+        initialize_db_with_tables(self.conn)
+        self.assertEqual(1, len(database.get_server_info(self.conn, "schema_version")))
+
+    def test_failed_step_is_rolled_back(self):
+        initialize_db_with_tables(self.conn)
+
+        def broken_step(conn):
+            conn.execute("CREATE TABLE raid_logs (id integer PRIMARY KEY)")
+            conn.execute("ALTER TABLE players ADD COLUMN lodestone_id integer")
+            raise database.Error("step failed halfway")
+
+        def next_step(conn):
+            conn.execute("CREATE TABLE raid_logs (id integer PRIMARY KEY)")
+
+        steps = database.MIGRATIONS + [(SCHEMA_VERSION + 1, "broken", broken_step)]
+        with mock.patch.object(database, "MIGRATIONS", steps), \
+                mock.patch.object(database, "SCHEMA_VERSION", SCHEMA_VERSION + 1):
+            with self.assertRaises(database.Error):
+                migrate(self.conn)
+        self.assertEqual(SCHEMA_VERSION, get_schema_version(self.conn))
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(players)")]
+        self.assertNotIn("lodestone_id", columns)
+
+        steps = database.MIGRATIONS + [(SCHEMA_VERSION + 1, "fixed", next_step)]
+        with mock.patch.object(database, "MIGRATIONS", steps), \
+                mock.patch.object(database, "SCHEMA_VERSION", SCHEMA_VERSION + 1):
+            self.assertEqual(SCHEMA_VERSION + 1, migrate(self.conn))
+
+
+class TransactionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        initialize_db_with_tables(self.conn)
+        self.ev_id = create_event(self.conn, ("Raid", 0, None, None, None, None, "2,2,4", 1, None, "RECRUITING",
+                                              None, None, None))
+        create_player(self.conn, (42, "Nama Zu", "PLD,DNC", "2021-05-01", 0, 0))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_update_event_fields(self):
+        update_event_fields(self.conn, {"participant_ids": "42", "is_bench": "0", "state": "COMPLETE"}, self.ev_id)
+        row = get_event(self.conn, self.ev_id)[0]
+        self.assertEqual(("42", "0", "COMPLETE"), (row[4], row[5], row[10]))
+        update_event_fields(self.conn, {"state": "CANCELLED", "no_such_column": 1}, self.ev_id)
+        self.assertEqual("COMPLETE", get_event(self.conn, self.ev_id)[0][10])
+
+    def test_commits_once(self):
+        commits = []
+        self.conn.set_trace_callback(lambda sql: commits.append(sql) if sql == "COMMIT" else None)
+        with transaction(self.conn):
+            update_player_fields(self.conn, {"num_raids": 1, "involuntary_benches": 2}, 42, "Nama Zu")
+            with transaction(self.conn):
+                update_event_fields(self.conn, {"jobs": "PLD", "state": "COMPLETE"}, self.ev_id)
+            self.assertTrue(self.conn.in_transaction)
+            self.assertEqual([], commits)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(1, len(commits))
+        self.assertEqual((1, 2), get_player(self.conn, 42, "Nama Zu")[0][5:])
+
+    def test_increment_player_counter(self):
+        create_player(self.conn, (43, "Na Mazu", "WHM", "2021-05-01", 5, None))
+        commits = []
+        self.conn.set_trace_callback(lambda sql: commits.append(sql) if sql == "COMMIT" else None)
+        increment_player_counter(self.conn, "num_raids", [(42, "Nama Zu"), (43, "Na Mazu")])
+        increment_player_counter(self.conn, "involuntary_benches", [(43, "Na Mazu")], amount=2)
+        increment_player_counter(self.conn, "jobs", [(43, "Na Mazu")])
+        self.assertEqual(2, len(commits))
+        self.assertEqual((1, 0), get_player(self.conn, 42, "Nama Zu")[0][5:])
+        self.assertEqual((6, 2), get_player(self.conn, 43, "Na Mazu")[0][5:])
+        self.assertEqual("WHM", get_player(self.conn, 43, "Na Mazu")[0][3])
+
+    def test_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with transaction(self.conn):
+                update_player_fields(self.conn, {"num_raids": 1}, 42, "Nama Zu")
+                update_event_fields(self.conn, {"state": "COMPLETE"}, self.ev_id)
+                raise RuntimeError("crashed halfway")
+        self.assertEqual(0, get_player(self.conn, 42, "Nama Zu")[0][5])
+        self.assertEqual("RECRUITING", get_event(self.conn, self.ev_id)[0][10])
+
+
+class AsyncDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_operations_run_on_database_thread(self):
+        async def scenario():
+            db = AsyncDatabase(1234)
+            try:
+                await db.initialize_db_with_tables()
+                await db.create_player((42, "Nama Zu", "PLD,DNC", "2021-05-01", 0, 0))
+                await db.update_player("num_raids", 3, 42, "Nama Zu")
+                rows = await db.get_player_by_id(42)
+                thread = await db.run(lambda conn: threading.current_thread())
+                return rows, thread
+            finally:
+                db.close()
+
+        rows, thread = asyncio.run(scenario())
+        self.assertEqual([(1, 42, "Nama Zu", "PLD,DNC", "2021-05-01", 3, 0)], rows)
+        self.assertIsNot(threading.main_thread(), thread)
+
+    def test_failed_initialization_is_not_retried(self):
+        os.makedirs("database", exist_ok=True)
+        with open("database/1234.db", "w") as f:
+            f.write("not a database" * 10)
+
+        async def scenario():
+            db = AsyncDatabase(1234)
+            errors = []
+            try:
+                for _ in range(3):
+                    try:
+                        await db.open()
+                    except Exception as e:
+                        errors.append(e)
+                return errors
+            finally:
+                db.close()
+
+        with mock.patch.object(database, "create_connection", wraps=database.create_connection) as opened:
+            errors = asyncio.run(scenario())
+        self.assertEqual(3, len(errors))
+        self.assertEqual(1, opened.call_count)
+        self.assertIsInstance(errors[-1], database.Error)
+
+    def test_connection_pragmas(self):
+        conn = create_connection(1234)
+        try:
+            self.assertEqual("wal", conn.execute("PRAGMA journal_mode").fetchone()[0])
+            self.assertEqual(1, conn.execute("PRAGMA synchronous").fetchone()[0])  # NORMAL
+        finally:
+            conn.close()
+
+    def test_list_guild_databases(self):
+        for name in [1234, 5678, "test"]:
+            create_connection(name).close()
+        self.assertEqual([1234, 5678], sorted(database.list_guild_databases()))
+
+    def test_pooled_handles(self):
+        async def scenario():
+            pool = ConnectionPool(AsyncDatabase)
+            conn = pool.get(1234)
+            await conn.initialize_db_with_tables()
+            ev_id = await conn.create_event(("Raid", 0, None, None, None, None, "2,2,4", 1, None, "RECRUITING",
+                                             None, None, None))
+            conn.close()
+            conn = pool.get(1234)
+            rows = await conn.get_event(ev_id)
+            conn.close()
+            pool.close_all()
+            return rows
+
+        self.assertEqual("Raid", asyncio.run(scenario())[0][1])
+
+
 if __name__ == '__main__':
     unittest.main()
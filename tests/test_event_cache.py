@@ -0,0 +1,97 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from raidbot import bot, database
+from raidbot.async_database import AsyncDatabase
+from raidbot.event import Event
+from raidbot.event_cache import EventCache
+
+
+def make_event(ev_id, message_id, state="RECRUITING"):
+    return Event(ev_id, "Raid", 0, None, None, None, None, "2,2,4", 1,
+                 f"https://discord.com/channels/11/22/{message_id}", state, 11, 22, message_id)
+
+
+class EventCacheTestCase(unittest.TestCase):
+    def test_lookup_by_id_and_message(self):
+        cache = EventCache()
+        event = make_event(1, 100)
+        cache.warm(11, [event, make_event(2, 200, state="COMPLETE")])
+
+        self.assertIs(event, cache.get(11, 1))
+        self.assertIs(event, cache.get(11, "1"))  # ids as typed in commands
+        self.assertIs(event, cache.get_by_message(11, 100))
+        self.assertIsNone(cache.get(11, 2))
+        self.assertIsNone(cache.get(12, 1))
+        self.assertIsNone(cache.get(11, "abc"))
+        self.assertEqual(1, len(cache))
+        self.assertIn(11, cache.warmed)
+
+    def test_evicted_when_leaving_recruiting(self):
+        cache = EventCache()
+        event = make_event(1, 100)
+        cache.put(11, event)
+        event.state = "CANCELLED"
+        cache.put(11, event)
+        self.assertIsNone(cache.get(11, 1))
+        self.assertIsNone(cache.get_by_message(11, 100))
+
+        cache.put(11, make_event(3, 300))
+        cache.evict(11, 3)
+        self.assertEqual(0, len(cache))
+
+    def test_warm_keeps_cached_events(self):
+        cache = EventCache()
+        in_use = make_event(1, 100)
+        cache.put(11, in_use)
+        cache.warm(11, [make_event(1, 100), make_event(2, 200)])
+        self.assertIs(in_use, cache.get_by_message(11, 100))
+        self.assertEqual(2, len(cache))
+
+
+class StartupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        # Fewer open connections than guilds, so the pool has to close some during startup
+        self.pool = database.ConnectionPool(AsyncDatabase, max_open=4)
+        patchers = [mock.patch.object(bot, "event_cache", EventCache()),
+                    mock.patch.object(bot, "connections", self.pool)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.pool.close_all()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_every_guild_initialized_once(self):
+        guild_ids = list(range(1, 11))
+        for guild_id in guild_ids:
+            database.create_connection(guild_id).close()
+        guilds = [SimpleNamespace(id=guild_id) for guild_id in guild_ids[:8]]
+
+        with mock.patch.object(type(bot.bot), "guilds", new_callable=mock.PropertyMock, return_value=guilds), \
+                mock.patch.object(database, "initialize_db_with_tables",
+                                  wraps=database.initialize_db_with_tables) as initialized:
+            asyncio.run(bot.start_up(3))
+        self.assertEqual(len(guild_ids), initialized.call_count)
+        self.assertEqual(set(guild_ids[:8]), bot.event_cache.warmed)
+
+    def test_phase_timings(self):
+        database.create_connection(1).close()
+        timings = {"initialize": 0.0, "warm": 0.0}
+        self.assertTrue(asyncio.run(bot.prepare_guild(1, True, timings)))
+        self.assertGreater(timings["initialize"], 0)
+        self.assertGreater(timings["warm"], 0)
+        self.assertIn(1, bot.event_cache.warmed)
+
+
+if __name__ == '__main__':
+    unittest.main()
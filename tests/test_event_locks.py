@@ -0,0 +1,129 @@
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from raidbot import bot
+from raidbot.character_cache import CharacterCache
+from raidbot.event_cache import EventCache
+from raidbot.event_locks import LockRegistry
+
+
+class LockRegistryTestCase(unittest.TestCase):
+    def test_serializes_per_key_only(self):
+        locks = LockRegistry()
+        order = []
+
+        async def hold(key, name, delay):
+            async with locks.hold(key):
+                order.append(f"{name} start")
+                await asyncio.sleep(delay)
+                order.append(f"{name} end")
+
+        async def scenario():
+            await asyncio.gather(hold("event 1", "a", 0.02), hold("event 1", "b", 0), hold("event 2", "c", 0))
+
+        asyncio.run(scenario())
+        self.assertLess(order.index("a end"), order.index("b start"))
+        self.assertLess(order.index("c end"), order.index("a end"))  # event 2 did not wait for event 1
+        self.assertEqual(0, len(locks))
+
+    def test_released_on_error(self):
+        locks = LockRegistry()
+
+        async def scenario():
+            with self.assertRaises(RuntimeError):
+                async with locks.hold("event 1"):
+                    raise RuntimeError()
+            self.assertFalse(locks.locked("event 1"))
+
+        asyncio.run(scenario())
+        self.assertEqual(0, len(locks))
+
+
+class ConcurrentReactionsTestCase(unittest.TestCase):
+    guild_id = 4242
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        # Every test starts with a new database, whose events must not be mixed up with ones cached by others
+        patchers = [mock.patch.object(bot, "event_cache", EventCache()),
+                    mock.patch.object(bot, "character_cache", CharacterCache())]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        bot.connections.close_all()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_hundreds_of_concurrent_reactions(self):
+        n_players, n_events = 60, 4
+        rng = random.Random(0)
+
+        async def scenario():
+            conn = bot.connections.get(self.guild_id)
+            for i in range(1, n_players + 1):
+                await conn.create_player((i, f"Player {i}", "PLD,WHM,DNC", "2021-05-01", 0, 0))
+            event_ids = [await conn.create_event((f"Raid {e}", 0, None, None, None, None, "2,2,4", 1, None,
+                                                  "RECRUITING", None, None, None)) for e in range(n_events)]
+            # Every player hammers every event with sign-ins and bench toggles at the same time
+            reactions = [(ev_id, user_id, action) for ev_id in event_ids for user_id in range(1, n_players + 1)
+                         for action in ["sign_in", "bench", "sign_in", "bench"]]
+            rng.shuffle(reactions)
+            results = await asyncio.gather(*[bot.change_roster(conn, self.guild_id, ev_id, user_id, action)
+                                             for ev_id, user_id, action in reactions])
+            rosters = [(bot.event_cache.get(self.guild_id, ev_id), await conn.get_event_participants(ev_id))
+                       for ev_id in event_ids]
+            conn.close()
+            return results, rosters
+
+        results, rosters = asyncio.run(scenario())
+        self.assertEqual(n_players * n_events * 4, len(results))
+        self.assertTrue(all(status in ["changed", "unchanged"] for status, _ in results))
+        for event, db_roster in rosters:
+            self.assertEqual(list(range(1, n_players + 1)), sorted(event.participant_ids))  # nobody lost or doubled
+            self.assertEqual([(p_id, bench) for p_id, bench in zip(event.participant_ids, event.is_bench)],
+                             [(p_id, bench) for p_id, _, bench, _ in db_roster])
+        self.assertEqual(0, len(bot.event_locks))
+
+    def test_failed_write_leaves_cache_unchanged(self):
+        async def fail(*args):
+            raise sqlite3.OperationalError("database is locked")
+
+        async def scenario():
+            conn = bot.connections.get(self.guild_id)
+            await conn.create_player((1, "Player 1", "PLD", "2021-05-01", 0, 0))
+            ev_id = await conn.create_event(("Raid", 0, None, None, None, None, "2,2,4", 1, None, "RECRUITING",
+                                             None, None, None))
+            with mock.patch.object(conn._conn, "add_participant", fail):
+                with self.assertRaises(sqlite3.OperationalError):
+                    await bot.change_roster(conn, self.guild_id, ev_id, 1, "sign_in")
+            event = await bot.load_event(conn, self.guild_id, ev_id)
+            db_roster = await conn.get_event_participants(ev_id)
+            conn.close()
+            return event, db_roster
+
+        event, db_roster = asyncio.run(scenario())
+        self.assertEqual([], event.participant_ids)
+        self.assertEqual([], db_roster)
+
+    def test_reactions_on_other_messages_skip_the_database(self):
+        reaction = SimpleNamespace(emoji=SimpleNamespace(name="record_ready_check"), member=SimpleNamespace(bot=False),
+                                   guild_id=self.guild_id, channel_id=1, message_id=999)
+        with mock.patch.object(bot, "event_message_ids", {self.guild_id: {100}}), \
+                mock.patch.object(bot.bot, "get_guild"), \
+                mock.patch.object(bot, "get_connection") as get_connection:
+            asyncio.run(bot.on_raw_reaction_add(reaction))
+        get_connection.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+import importlib.util
+import itertools
+import math
+import random
+import sqlite3
+import threading
+import time
+import unittest
+
+from raidbot.raidbuilder import Character, JOBS, make_raid, exhaustive_candidates, CompositionCollector, SearchToken, \
+    SearchCancelled, make_characters_from_db, JOB_IDS, TANKS, HEALERS, DPS, MELEES, RANGED, CASTERS, TANK_MASK, \
+    DPS_MASK, composition_bonus, jobs_mask, RoleFeasibility, roles_of, calc_composition_score, \
+    previous_twins, split_search, prefix_size, branch_and_bound_candidates
+from raidbot.database import initialize_db_with_tables, create_player
+
+
+def random_roster(rng, n_players):
+    roster = []
+    for i in range(n_players):
+        jobs = rng.sample(JOBS, rng.randint(1, 4))
+        chara = Character(i, f"Player {i}", jobs, rng.randint(0, 3))
+        chara.benched = rng.random() < 0.2
+        roster.append(chara)
+    return roster
+
+
+def roster_with_twins(rng, n_players):
+    roster = random_roster(rng, n_players // 2)
+    while len(roster) < n_players:
+        original = rng.choice(roster)
+        twin = Character(len(roster), f"Player {len(roster)}", original.jobs, original.involuntary_benches)
+        twin.benched = original.benched
+        roster.insert(rng.randint(0, len(roster)), twin)
+    return roster
+
+
+def canonical_raid(roster, group, comp, twins):
+    """The composition of group and comp that uses the earliest twins, with their jobs in order of their job lists"""
+    classes = [i if twin < 0 else None for i, twin in enumerate(twins)]
+    for i, twin in enumerate(twins):
+        if twin >= 0:
+            classes[i] = classes[twin]
+    indices = [roster.index(member) for member in group]
+    job_idx = {}
+    for i, job in zip(indices, comp):
+        job_idx.setdefault(classes[i], []).append(roster[i].jobs.index(job))
+    picked = {}
+    for c, jobs in job_idx.items():
+        members = [i for i in range(len(roster)) if classes[i] == c][:len(jobs)]
+        picked.update(zip(members, sorted(jobs)))
+    return tuple((i, roster[i].jobs[j]) for i, j in sorted(picked.items()))
+
+
+class SolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.participants = [
+            Character(1, "Nama Zu", "GNB,PLD,MCH", 1),
+            Character(2, "Na Mazu", "DRK,GNB,MNK", 0),
+            Character(3, "Zu Nama", "WHM,AST,PLD,BRD", 0),
+            Character(4, "Zuna Ma", "BLM,SMN,RDM,SCH", 0),
+            Character(5, "Mama Zu", "BRD,WHM,RDM", 0),
+            Character(6, "Uza Man", "MNK,SAM,GNB", 0),
+            Character(7, "Zuzu Nana", "DNC", 0),
+            Character(8, "Yes Yes", "PLD,WAR,MCH,DNC", 0),
+            Character(9, "Dummy Thicc", "BLM,SAM", 0),
+            Character(10, "Blue Chicken", "WHM,SMN", 0),
+            Character(11, "Ragu Bolognese", "DRG,NIN", 0)
+        ]
+        for i in (2, 3, 9):
+            self.participants[i].benched = True
+
+    def test_branch_and_bound_matches_exhaustive(self):
+        expected = make_raid(self.participants, 2, 2, 4, solver="exhaustive")
+        self.assertEqual(expected, make_raid(self.participants, 2, 2, 4, solver="branch_and_bound"))
+
+    def test_random_rosters(self):
+        rng = random.Random(1234)
+        for _ in range(40):
+            roster = random_roster(rng, rng.randint(4, 9))
+            roles = rng.choice([(1, 1, 2), (2, 2, 4), (1, 2, 1)])
+            settings = dict(no_double_jobs=rng.random() < 0.5, maximize_diverse_dps=rng.random() < 0.5,
+                            use_benched_counter=rng.random() < 0.5)
+            self.assertEqual(make_raid(roster, *roles, solver="exhaustive", **settings),
+                             make_raid(roster, *roles, solver="branch_and_bound", **settings))
+
+    def test_top_k(self):
+        rng = random.Random(99)
+        for _ in range(20):
+            roster = random_roster(rng, rng.randint(5, 8))
+            top_k = rng.randint(1, 6)
+            every = sorted(exhaustive_candidates(roster, 1, 1, 2), key=lambda x: (-x[1], x[0]))
+            expected = [[tuple(roster[i] for i in g), tuple(roster[i].jobs[j] for i, j in zip(g, c)), score]
+                        for (g, c), score in every[:top_k]]
+            for solver in ("exhaustive", "branch_and_bound"):
+                self.assertEqual(expected, make_raid(roster, 1, 1, 2, solver=solver, top_k=top_k, merge_twins=False))
+
+    def test_collector_keeps_ties_only(self):
+        collector = CompositionCollector()
+        collector.consume([(((1,), (0,)), 5), (((0,), (0,)), 7), (((2,), (1,)), 7), (((3,), (0,)), 6)])
+        self.assertEqual([(((0,), (0,)), 7), (((2,), (1,)), 7)], collector.results())
+
+    @unittest.skipIf(importlib.util.find_spec("numpy") is None, "numpy is not installed")
+    def test_numpy_backend(self):
+        rng = random.Random(4321)
+        for _ in range(40):
+            roster = random_roster(rng, rng.randint(4, 9))
+            roles = rng.choice([(1, 1, 2), (2, 2, 4), (1, 2, 1)])
+            settings = dict(no_double_jobs=rng.random() < 0.5, maximize_diverse_dps=rng.random() < 0.5,
+                            use_benched_counter=rng.random() < 0.5, top_k=rng.choice([None, 3]))
+            self.assertEqual(make_raid(roster, *roles, solver="exhaustive", **settings),
+                             make_raid(roster, *roles, solver="exhaustive", backend="numpy", **settings))
+
+    def test_parallel_matches_serial(self):
+        rng = random.Random(2468)
+        for _ in range(5):
+            roster = random_roster(rng, rng.randint(6, 10))
+            for solver in ("branch_and_bound", "exhaustive"):
+                self.assertEqual(make_raid(roster, 1, 1, 2, solver=solver),
+                                 make_raid(roster, 1, 1, 2, solver=solver, workers=2))
+
+    def test_split_search(self):
+        for n_characters, n_raiders, n_chunks in [(24, 8, 64), (11, 8, 8), (9, 4, 3), (8, 8, 4)]:
+            chunks = split_search(n_characters, n_raiders, n_chunks)
+            groups = [group for chunk in chunks for prefix in chunk
+                      for group in itertools.combinations(range(n_characters), n_raiders)
+                      if group[:len(prefix)] == prefix] if n_characters < 24 else None
+            if groups is not None:
+                self.assertEqual(sorted(itertools.combinations(range(n_characters), n_raiders)), sorted(groups))
+            sizes = [sum(prefix_size(n_characters, n_raiders, prefix) for prefix in chunk) for chunk in chunks]
+            self.assertEqual(math.comb(n_characters, n_raiders), sum(sizes))
+            self.assertLessEqual(len(chunks), n_chunks)
+            if n_characters == 24:
+                self.assertLess(max(sizes), 1.5 * sum(sizes) / n_chunks)  # no chunk holds a third of the work
+
+    def test_prefixes_cover_search(self):
+        chunks = split_search(len(self.participants), 4, 5)
+        collector = CompositionCollector()
+        for chunk in chunks:
+            collector.consume(branch_and_bound_candidates(self.participants, 1, 1, 2, prefixes=chunk))
+        self.assertEqual(make_raid(self.participants, 1, 1, 2, solver="exhaustive"),
+                         [[tuple(self.participants[i] for i in g),
+                           tuple(self.participants[i].jobs[j] for i, j in zip(g, c)), score]
+                          for (g, c), score in collector.results()])
+
+    def test_token_progress(self):
+        for solver in ("branch_and_bound", "exhaustive"):
+            for workers in (1, 2):
+                token = SearchToken()
+                make_raid(self.participants, 1, 1, 2, solver=solver, workers=workers, token=token)
+                self.assertAlmostEqual(1.0, token.progress)
+
+    def test_token_cancel(self):
+        token = SearchToken()
+        token.cancel()
+        with self.assertRaises(SearchCancelled):
+            make_raid(self.participants, 2, 2, 4, token=token)
+
+        token = SearchToken(time_budget=1e-9)
+        with self.assertRaises(SearchCancelled):
+            make_raid(self.participants, 2, 2, 4, solver="exhaustive", token=token)
+        self.assertTrue(token.timed_out)
+
+    def test_role_feasibility_keeps_viable_groups(self):
+        rng = random.Random(24)
+        n_pruned = 0
+        for _ in range(20):
+            roster = random_roster(rng, 6)
+            roles = rng.choice([(1, 1, 2), (0, 1, 3), (1, 2, 1)])
+            feasible = RoleFeasibility(*roles)
+            for group in itertools.combinations(roster, 4):
+                viable = any(calc_composition_score(group, comp, *roles) > 0
+                             for comp in itertools.product(*[member.jobs for member in group]))
+                can_fill = feasible([roles_of(member.job_mask) for member in group],
+                                    jobs_mask(job for member in group for job in member.jobs))
+                self.assertTrue(can_fill or not viable)
+                n_pruned += not can_fill
+        self.assertGreater(n_pruned, 0)
+
+    def test_pruning_counters(self):
+        tokens = []
+        for workers in (1, 2):
+            token = SearchToken()
+            make_raid(self.participants, 1, 1, 2, solver="exhaustive", workers=workers, token=token)
+            tokens.append(token)
+        self.assertGreater(tokens[0].pruned_groups, 0)
+        self.assertGreaterEqual(tokens[0].pruned_products, tokens[0].pruned_groups)
+        self.assertEqual((tokens[0].pruned_groups, tokens[0].pruned_products),
+                         (tokens[1].pruned_groups, tokens[1].pruned_products))
+
+        for workers in (1, 2):
+            token = SearchToken()
+            make_raid(self.participants, 1, 1, 2, workers=workers, token=token)
+            self.assertGreater(token.pruned_groups, 0)
+            self.assertGreater(token.pruned_products, 0)
+
+    def test_merge_twins(self):
+        rng = random.Random(25)
+        for _ in range(20):
+            roster = roster_with_twins(rng, rng.randint(5, 9))
+            roles = rng.choice([(1, 1, 2), (1, 2, 1)])
+            twins = previous_twins(roster)
+            every = make_raid(roster, *roles, solver="exhaustive", merge_twins=False)
+            merged = make_raid(roster, *roles, solver="exhaustive")
+            self.assertEqual({(canonical_raid(roster, g, c, twins), s) for g, c, s in every},
+                             {(canonical_raid(roster, g, c, twins), s) for g, c, s in merged})
+            self.assertEqual(len(merged), len({canonical_raid(roster, g, c, twins) for g, c, _ in merged}))
+            self.assertLessEqual(len(merged), len(every))
+            self.assertEqual(merged, make_raid(roster, *roles, solver="branch_and_bound"))
+            self.assertEqual(merged, make_raid(roster, *roles, solver="branch_and_bound", workers=2))
+            if importlib.util.find_spec("numpy") is not None:
+                self.assertEqual(merged, make_raid(roster, *roles, solver="exhaustive", backend="numpy"))
+
+    def test_twins_need_same_profile(self):
+        roster = [Character(1, "A", "PLD,WHM", 0), Character(2, "B", "PLD,WHM", 0), Character(3, "C", "PLD,WHM", 1),
+                  Character(4, "D", "WHM,PLD", 0), Character(5, "E", "PLD,WHM", 0)]
+        roster[4].benched = True
+        self.assertEqual([-1, 0, -1, -1, -1], previous_twins(roster))
+        self.assertEqual([-1, 0, 1, -1, -1], previous_twins(roster, use_benched_counter=False))
+        self.assertIsNone(previous_twins(roster[2:]))
+
+    def test_cancel_stops_worker_chunks(self):
+        roster = random_roster(random.Random(5), 18)
+        for token in (SearchToken(time_budget=0.5), SearchToken()):
+            if not token.deadline:
+                threading.Timer(0.5, token.cancel).start()
+            with self.assertRaises(SearchCancelled):
+                make_raid(roster, 2, 2, 4, solver="exhaustive", merge_twins=False, workers=2, token=token)
+            self.assertEqual(token.deadline is not None, token.timed_out)
+            # The chunks of the stopped search don't keep the workers busy
+            begin = time.monotonic()
+            make_raid(self.participants, 1, 1, 2, workers=2)
+            self.assertLess(time.monotonic() - begin, 5)
+
+    def test_no_viable_composition(self):
+        roster = [Character(i, f"Player {i}", "WHM", 0) for i in range(4)]
+        self.assertEqual([], make_raid(roster, 1, 1, 2))
+        self.assertEqual([], make_raid(roster, 1, 1, 2, solver="exhaustive"))
+
+    def test_unknown_solver(self):
+        with self.assertRaises(ValueError):
+            make_raid(self.participants, 2, 2, 4, solver="guess")
+
+    def test_backend_needs_exhaustive_solver(self):
+        with self.assertRaises(ValueError):
+            make_raid(self.participants, 2, 2, 4, backend="numpy")
+
+
+class JobRegistryTestCase(unittest.TestCase):
+    def test_role_masks(self):
+        self.assertEqual(set(TANKS), {job for job in JOBS if TANK_MASK & (1 << JOB_IDS[job])})
+        self.assertEqual(set(DPS), {job for job in JOBS if DPS_MASK & (1 << JOB_IDS[job])})
+        self.assertEqual((1 << len(JOBS)) - 1, jobs_mask(TANKS) | jobs_mask(HEALERS) | DPS_MASK)
+
+    def test_character_tables(self):
+        chara = Character(1, "Nama Zu", "GNB,PLD,MCH", 0)
+        self.assertEqual((JOB_IDS["GNB"], JOB_IDS["PLD"], JOB_IDS["MCH"]), chara.job_ids)
+        self.assertEqual(jobs_mask(["MCH", "GNB", "PLD"]), chara.job_mask)
+        self.assertEqual(1, chara.job_priority[JOB_IDS["PLD"]])
+        self.assertEqual(-1, chara.job_priority[JOB_IDS["WHM"]])
+        chara.set_jobs(["PLD"])
+        self.assertEqual(0, chara.job_priority[JOB_IDS["PLD"]])
+        self.assertEqual(-1, chara.job_priority[JOB_IDS["GNB"]])
+        for bad_jobs in (["PLD", "PLD"], ["GLD"], ["XYZ"]):
+            with self.assertRaises(SyntaxError):
+                chara.set_jobs(bad_jobs)
+
+    def test_bonus_matches_job_lists(self):
+        rng = random.Random(23)
+        for _ in range(500):
+            picked = [rng.choice(JOBS) for _ in range(rng.randint(1, 8))]
+            expected = -8 if len(set(picked)) != len(picked) else 0
+            dps_types = sum(any(job in picked for job in role) for role in (MELEES, RANGED, CASTERS))
+            expected += {2: 2, 3: 4}.get(dps_types, 0)
+            self.assertEqual(expected, composition_bonus(tuple(picked)))
+
+
+class BulkLoadingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        initialize_db_with_tables(self.conn)
+        create_player(self.conn, (1, "Nama Zu", "PLD,DNC", "2021-05-01", 3, 1))
+        create_player(self.conn, (2, "Na Mazu", "WHM", "2021-05-01", 0, 2))
+        create_player(self.conn, (2, "Mazu Na", "BLM", "2021-05-01", 5, 0))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_roster_order_in_one_query(self):
+        queries = []
+        self.conn.set_trace_callback(queries.append)
+        loaded = make_characters_from_db(self.conn, [2, 1, 2], ["Mazu Na", "Nama Zu", "Na Mazu"])
+        self.assertEqual(1, len(queries))
+        self.assertEqual([("Mazu Na", ["BLM"], 5, 0), ("Nama Zu", ["PLD", "DNC"], 3, 1), ("Na Mazu", ["WHM"], 0, 2)],
+                         [(c.character_name, c.jobs, n_raids, benches) for c, n_raids, benches in loaded])
+
+    def test_missing_player(self):
+        with self.assertRaises(ValueError):
+            make_characters_from_db(self.conn, [1, 3], ["Nama Zu", "Nobody"])
+
+
+if __name__ == '__main__':
+    unittest.main()
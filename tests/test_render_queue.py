@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from raidbot.render_queue import RenderQueue
+
+
+class RenderQueueTestCase(unittest.TestCase):
+    def test_coalesces_renders_per_key(self):
+        rendered = []
+
+        def render(key, version):
+            async def coro():
+                rendered.append((key, version))
+            return coro
+
+        async def scenario():
+            queue = RenderQueue(delay=0.05)
+            for version in range(20):
+                queue.schedule("event 1", render("event 1", version))
+            queue.schedule("event 2", render("event 2", 0))
+            await asyncio.sleep(0.1)
+            queue.schedule("event 1", render("event 1", 20))
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        self.assertEqual([("event 1", 19), ("event 2", 0), ("event 1", 20)], rendered)
+
+    def test_discard(self):
+        rendered = []
+
+        async def render():
+            rendered.append(True)
+
+        async def scenario():
+            queue = RenderQueue(delay=0.05)
+            queue.schedule("event 1", render)
+            self.assertIn("event 1", queue)
+            queue.discard("event 1")
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        self.assertEqual([], rendered)
+
+
+if __name__ == '__main__':
+    unittest.main()
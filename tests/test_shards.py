@@ -0,0 +1,56 @@
+import sys
+import tempfile
+import time
+import unittest
+
+from raidbot.shards import ShardSupervisor, shard_of, write_status, read_status
+
+
+class ShardTestCase(unittest.TestCase):
+    def test_shard_of(self):
+        # discord's sharding formula, guilds spread over all shards
+        self.assertEqual(0, shard_of(0, 4))
+        self.assertEqual(3, shard_of(3 << 22, 4))
+        self.assertEqual({0, 1, 2}, {shard_of(guild_id << 22, 3) for guild_id in range(10)})
+
+    def test_status_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(read_status(0, tmp))
+            write_status(0, {"guilds": 12, "reactions": 3}, tmp)
+            status = read_status(0, tmp)
+        self.assertEqual((12, 3), (status["guilds"], status["reactions"]))
+
+    def test_restarts_crashed_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            supervisor = ShardSupervisor(2, [sys.executable, "-c", "import sys; sys.exit(1)"], tmp,
+                                         restart_delay=0.0, identify_delay=0.0)
+            self.assertEqual([], supervisor.step())
+            for shard in supervisor.shards:
+                shard.process.wait()
+            self.assertEqual([0, 1], supervisor.step())  # and started again right away
+            self.assertTrue(all(shard.process is not None for shard in supervisor.shards))
+            self.assertEqual([1, 1], [shard.restarts for shard in supervisor.shards])
+            self.assertEqual(2, len(supervisor.report()))
+            supervisor.stop()
+
+    def test_first_starts_are_spaced(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            supervisor = ShardSupervisor(3, [sys.executable, "-c", "pass"], tmp, identify_delay=5.0)
+            supervisor.step()
+            self.assertEqual([True, False, False], [shard.process is not None for shard in supervisor.shards])
+            self.assertGreater(supervisor.shards[2].next_start, supervisor.shards[1].next_start + 4)
+            supervisor.stop()
+
+    def test_restart_backoff(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            supervisor = ShardSupervisor(1, [sys.executable, "-c", "pass"], tmp, restart_delay=60.0)
+            supervisor.step()
+            supervisor.shards[0].process.wait()
+            supervisor.step()
+            self.assertIsNone(supervisor.shards[0].process)  # waits before starting it again
+            self.assertGreater(supervisor.shards[0].next_start, time.monotonic() + 30)
+            self.assertIn("down", supervisor.report()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()